@@ -1,10 +1,33 @@
+import functools
 import hashlib
+import inspect
 import json
+import logging
+import os
+import pickle
+import threading
+import weakref
+from collections import OrderedDict
+from pathlib import Path
+from typing import ClassVar
 
+import fastparquet
+import numpy as np
+import pandas as pd
 from pandas.util import hash_pandas_object
 
+logger = logging.getLogger(__name__)
+
 cache_dir = "ampelmatch_cache"
 
+# parquet metadata entry with the index and Series names of cached frames
+METADATA_KEY = "ampelmatch_names"
+
+# rows are hashed in chunks of this size to bound the memory of the row hashes
+HASH_CHUNK_ROWS = 1_000_000
+
+_fingerprints = {}
+
 
 def model_hash(models, kwds):
     dicts = [m.model_dump() for m in models]
@@ -16,9 +39,46 @@ def model_hash(models, kwds):
     return hashlib.sha256(s).hexdigest()
 
 
+def register_fingerprint(df: pd.DataFrame, fingerprint: str):
+    """Use ``fingerprint`` instead of the contents of ``df``, as long as it lives"""
+    i = id(df)
+    _fingerprints[i] = (
+        weakref.ref(df, lambda _: _fingerprints.pop(i, None)),
+        fingerprint,
+    )
+
+
+def registered_fingerprint(df: pd.DataFrame) -> str | None:
+    known = _fingerprints.get(id(df))
+    if known is not None and known[0]() is df:
+        return known[1]
+    return None
+
+
+def file_fingerprint(filename: str | Path) -> str:
+    """Hash of path, size and mtime of a file, or of all files in a directory"""
+    filename = Path(filename).resolve()
+    files = sorted(filename.rglob("*")) if filename.is_dir() else [filename]
+    stats = [
+        (str(f), f.stat().st_size, f.stat().st_mtime_ns) for f in files if f.is_file()
+    ]
+    return hashlib.sha256(str(stats).encode()).hexdigest()
+
+
 def dataframe_hash(df):
-    h1 = hashlib.sha256(hash_pandas_object(df).values).hexdigest()
-    h2 = hashlib.sha256(df.columns.to_numpy().astype(str)).hexdigest()
+    """
+    Content hash of all rows of the DataFrame or Series ``df``. Frames with a registered fingerprint
+    are not read at all.
+    """
+    known = registered_fingerprint(df)
+    if known is not None:
+        return known
+    rows = hashlib.sha256()
+    for start in range(0, len(df), HASH_CHUNK_ROWS):
+        rows.update(hash_pandas_object(df.iloc[start : start + HASH_CHUNK_ROWS]).values)
+    h1 = rows.hexdigest()
+    columns = df.columns if isinstance(df, pd.DataFrame) else pd.Index([df.name])
+    h2 = hashlib.sha256(columns.to_numpy().astype(str)).hexdigest()
     h3 = hashlib.sha256(df.index.to_numpy()).hexdigest()
     return hashlib.sha256((h1 + h2 + h3).encode()).hexdigest()
 
@@ -26,12 +86,216 @@ def dataframe_hash(df):
 def compute_density_hash(args, kwargs):
     if len(args) > 0:
         raise ValueError("args not supported")
+    kwargs = dict(kwargs)
     dfs = kwargs.pop("data")
-    nside = kwargs.pop("nside")
-    if len(kwargs) > 0:
-        raise ValueError(f"unexpected kwargs: {list(kwargs.keys())}!")
     df_hash = hashlib.sha256(
         str(tuple(dataframe_hash(df) for df in dfs)).encode()
     ).hexdigest()
-    nside_hash = hashlib.sha256(str(nside).encode()).hexdigest()
-    return hashlib.sha256((df_hash + nside_hash).encode()).hexdigest()
+    other_hash = hashlib.sha256(str(sorted(kwargs.items())).encode()).hexdigest()
+    return hashlib.sha256((df_hash + other_hash).encode()).hexdigest()
+
+
+class TieredCache:
+    """
+    Two tier cache: an in-process LRU of at most ``max_memory_bytes`` in front
+    of an on-disk store. DataFrames and Series are stored as parquet, numeric
+    arrays as npy and everything else is pickled. When the store grows beyond
+    ``max_bytes``, the least recently used entries are removed.
+    """
+
+    suffixes: ClassVar[tuple[str, ...]] = (
+        ".parquet",
+        ".series.parquet",
+        ".npy",
+        ".pkl",
+    )
+
+    def __init__(
+        self,
+        directory: str | Path,
+        max_memory_bytes: int = 2**30,
+        max_bytes: int = 10 * 2**30,
+    ):
+        self.directory = Path(directory)
+        self.max_memory_bytes = max_memory_bytes
+        self.max_bytes = max_bytes
+        self.memory = OrderedDict()
+        self.memory_sizes = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    @functools.cache
+    def default(cls) -> "TieredCache":
+        return cls(Path(cache_dir) / "store")
+
+    def files(self, key: str) -> list[Path]:
+        return [
+            f for f in (self.directory / (key + s) for s in self.suffixes) if f.exists()
+        ]
+
+    @staticmethod
+    def copy(value):
+        # the caller gets its own data, changing it must not change the cache
+        if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)):
+            return value.copy()
+        return value
+
+    @staticmethod
+    def nbytes(value) -> int:
+        if isinstance(value, pd.DataFrame):
+            return int(value.memory_usage(deep=True).sum())
+        if isinstance(value, pd.Series):
+            return int(value.memory_usage(deep=True))
+        if isinstance(value, np.ndarray):
+            return value.nbytes
+        return 0
+
+    def get(self, key: str):
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return self.copy(self.memory[key])
+        files = self.files(key)
+        if len(files) == 0:
+            raise KeyError(key)
+        try:
+            value = self.read(files[0])
+        except (OSError, EOFError, KeyError, ValueError, pickle.UnpicklingError) as e:
+            # truncated or otherwise broken entry, recompute it
+            logger.warning(f"removing unreadable cache entry {files[0]}: {e!r}")
+            files[0].unlink(missing_ok=True)
+            raise KeyError(key) from e
+        os.utime(files[0])
+        self.remember(key, value)
+        return self.copy(value)
+
+    def __contains__(self, key: str) -> bool:
+        return (key in self.memory) or (len(self.files(key)) > 0)
+
+    def set(self, key: str, value):
+        self.directory.mkdir(exist_ok=True, parents=True)
+        self.write(self.directory / key, value)
+        self.remember(key, value)
+        self.evict()
+
+    def remember(self, key: str, value):
+        size = self.nbytes(value)
+        with self.lock:
+            self.forget(key)
+            if size > self.max_memory_bytes:
+                return
+            self.memory[key] = value
+            self.memory_sizes[key] = size
+            while sum(self.memory_sizes.values()) > self.max_memory_bytes:
+                self.forget(next(iter(self.memory)))
+
+    def forget(self, key: str):
+        self.memory.pop(key, None)
+        self.memory_sizes.pop(key, None)
+
+    def read(self, filename: Path):
+        logger.debug(f"reading {filename}")
+        if filename.suffix == ".parquet":
+            # parquet does not keep unnamed indices and Series names, see write
+            parquet = fastparquet.ParquetFile(filename)
+            names = json.loads(parquet.key_value_metadata[METADATA_KEY])
+            value = parquet.to_pandas()
+            value.index.names = names["index"]
+            if filename.name.endswith(".series.parquet"):
+                value = value.iloc[:, 0].rename(names["series"])
+            return value
+        if filename.suffix == ".npy":
+            return np.load(filename)
+        with filename.open("rb") as f:
+            return pickle.load(f)
+
+    def write(self, stem: Path, value):
+        # unique per process, workers might store the same entry concurrently
+        tmp = stem.parent / (stem.name + f".{os.getpid()}.tmp")
+        try:
+            if isinstance(value, (pd.Series, pd.DataFrame)):
+                names = {"index": list(value.index.names)}
+                if isinstance(value, pd.Series):
+                    filename = stem.parent / (stem.name + ".series.parquet")
+                    names["series"] = value.name
+                    value = value.to_frame("values")
+                else:
+                    filename = stem.parent / (stem.name + ".parquet")
+                value.to_parquet(
+                    tmp,
+                    engine="fastparquet",
+                    custom_metadata={METADATA_KEY: json.dumps(names)},
+                )
+            elif isinstance(value, np.ndarray) and value.dtype.kind in "biufc":
+                filename = stem.parent / (stem.name + ".npy")
+                with tmp.open("wb") as f:
+                    np.save(f, value)
+            else:
+                raise TypeError
+        except (TypeError, ValueError, NotImplementedError) as e:
+            # not representable as parquet / npy, e.g. object columns
+            logger.debug(f"pickling {stem.name}: {e!r}")
+            filename = stem.parent / (stem.name + ".pkl")
+            with tmp.open("wb") as f:
+                pickle.dump(value, f)
+        tmp.replace(filename)
+        logger.debug(f"wrote {filename}")
+
+    def evict(self):
+        if not self.directory.exists():
+            return
+        files = [f for f in self.directory.iterdir() if f.suffix != ".tmp"]
+        stats = {f: f.stat() for f in files}
+        total = sum(s.st_size for s in stats.values())
+        for f in sorted(files, key=lambda f: stats[f].st_mtime):
+            if total <= self.max_bytes:
+                break
+            logger.debug(f"evicting {f}")
+            total -= stats[f].st_size
+            f.unlink(missing_ok=True)
+
+    def invalidate(self, prefix: str = ""):
+        """Remove all entries whose key starts with ``prefix``"""
+        with self.lock:
+            for key in [k for k in self.memory if k.startswith(prefix)]:
+                self.forget(key)
+        if self.directory.exists():
+            for f in self.directory.glob(prefix + "*"):
+                f.unlink(missing_ok=True)
+
+
+def cached(hash_func, cache: TieredCache | None = None):
+    """
+    Cache the results of a function in a TieredCache. As with cachier,
+    ``hash_func`` gets ``(args, kwargs)`` with all arguments bound to their
+    names, ``ignore_cache=True`` recomputes without touching the cache and
+    ``overwrite_cache=True`` recomputes and stores.
+    """
+
+    def decorator(func):
+        signature = inspect.signature(func)
+        prefix = f"{func.__module__}.{func.__qualname__}-"
+
+        @functools.wraps(func)
+        def wrapper(*args, ignore_cache=False, overwrite_cache=False, **kwargs):
+            if ignore_cache:
+                return func(*args, **kwargs)
+            store = cache or TieredCache.default()
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = prefix + hash_func((), bound.arguments)
+            if not overwrite_cache:
+                try:
+                    return store.get(key)
+                except KeyError:
+                    pass
+            value = func(*args, **kwargs)
+            store.set(key, value)
+            return store.copy(value)
+
+        wrapper.clear_cache = lambda: (cache or TieredCache.default()).invalidate(
+            prefix
+        )
+        return wrapper
+
+    return decorator
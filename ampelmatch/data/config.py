@@ -1,5 +1,7 @@
 from typing import Literal, Annotated, Union
+import contextlib
 import logging
+import numpy as np
 import shapely
 import json
 from pydantic import BaseModel, Field, field_validator, ConfigDict, field_serializer
@@ -8,6 +10,31 @@ from ampelmatch.cache import model_hash
 logger = logging.getLogger(__name__)
 
 
+def config_seed(*configs: BaseModel) -> int:
+    """Deterministic 32 bit RNG seed derived from the hash of the configs"""
+    return int(model_hash(list(configs), {})[:8], 16)
+
+
+def block_seed(seed: int, block: int) -> int:
+    """Independent 32 bit RNG seed for one block of a chunked simulation"""
+    return int(np.random.SeedSequence([seed, block]).generate_state(1)[0])
+
+
+@contextlib.contextmanager
+def seeded(seed: int):
+    """
+    Seed the global numpy RNG and restore its state afterwards. skysurvey 0.17 and modeldag < 0.11 draw everything
+    from the global RNG (scipy.stats included), which is why modeldag is pinned below 0.11: later versions draw from
+    unseeded generators that skysurvey does not pass on.
+    """
+    state = np.random.get_state()
+    np.random.seed(seed)
+    try:
+        yield
+    finally:
+        np.random.set_state(state)
+
+
 class BaseUncertaintyConfig(BaseModel):
     """
     Configuration class for uncertainties
@@ -100,4 +127,4 @@ class DatasetConfig(BaseModel):
     transients: list[Transient]
 
     def get_hash(self):
-        return model_hash([self], dict())
+        return model_hash([self], {})
@@ -1,11 +1,16 @@
 import logging
+import shutil
 import skysurvey
-from cachier import cachier
+import pandas as pd
+import healpy as hp
+import fastparquet
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Literal
 import itertools
 
-from ampelmatch.cache import cache_dir, model_hash
-from ampelmatch.data.config import DatasetConfig, Survey, Transient
+from ampelmatch.cache import cached, model_hash
+from ampelmatch.data.config import DatasetConfig, Survey, Transient, block_seed, config_seed, seeded
 from ampelmatch.data.positional_dataset import PositionalDataset
 from ampelmatch.data.transients import TransientGenerator
 from ampelmatch.data.surveys import SurveyGenerator
@@ -13,6 +18,72 @@ from ampelmatch.data.surveys import SurveyGenerator
 
 logger = logging.getLogger(__name__)
 
+OutputFormat = Literal["csv", "parquet"]
+# full precision is needed for positions and times, everything else is stored as float32 / int32
+FULL_PRECISION_COLUMNS = ["ra", "dec", "mjd", "time", "source_index", "hpx_fine"]
+# chunked simulations collect this many detections before writing, every write adds one file per parquet partition
+FLUSH_ROWS = 1_000_000
+
+
+def compact_dtypes(data: pd.DataFrame) -> pd.DataFrame:
+    dtypes = {}
+    for c, dtype in data.dtypes.items():
+        if c in FULL_PRECISION_COLUMNS:
+            continue
+        if dtype.kind == "f":
+            dtypes[c] = "float32"
+        elif dtype.kind in "iu":
+            dtypes[c] = "int32"
+    return data.astype(dtypes)
+
+
+def check_nsides(coarse_nside: int, fine_nside: int):
+    """The coarse pixel is derived from the fine one by a bit shift, so both have to be powers of two"""
+    for name, nside in [("coarse_nside", coarse_nside), ("fine_nside", fine_nside)]:
+        if not hp.isnsideok(nside, nest=True):
+            raise ValueError(f"{name} {nside} is not a power of two")
+    if fine_nside < coarse_nside:
+        raise ValueError(f"fine_nside {fine_nside} is smaller than coarse_nside {coarse_nside}")
+
+
+def write_partitioned(data: pd.DataFrame, filename: Path, coarse_nside: int, fine_nside: int, append: bool = False):
+    """
+    Write detections as a parquet dataset, partitioned by the NESTED HEALPix pixel at coarse_nside (hpx_coarse).
+    The NESTED pixel at fine_nside is stored in hpx_fine, the index is stored as columns.
+    """
+    check_nsides(coarse_nside, fine_nside)
+    if not append:
+        shutil.rmtree(filename, ignore_errors=True)
+    data = compact_dtypes(data.reset_index())
+    data["hpx_fine"] = hp.ang2pix(fine_nside, data["ra"].to_numpy(), data["dec"].to_numpy(), nest=True, lonlat=True)
+    # with NESTED ordering the coarse pixel is a bit shift of the fine one
+    shift = 2 * ((fine_nside // coarse_nside).bit_length() - 1)
+    data["hpx_coarse"] = (data["hpx_fine"].to_numpy() >> shift).astype("int32")
+    fastparquet.write(
+        str(filename),
+        data,
+        partition_on=["hpx_coarse"],
+        file_scheme="hive",
+        write_index=False,
+        append=append and filename.exists(),
+        custom_metadata={"coarse_nside": str(coarse_nside), "fine_nside": str(fine_nside)}
+    )
+
+
+def remove_output(filename: Path):
+    if filename.is_dir():
+        shutil.rmtree(filename)
+    else:
+        filename.unlink(missing_ok=True)
+
+
+def write_data(data: pd.DataFrame, filename: Path, output_format: OutputFormat, coarse_nside: int, fine_nside: int, append: bool = False):
+    data.index.names = ["source_index", "detection_index"]
+    if output_format == "parquet":
+        write_partitioned(data, filename, coarse_nside, fine_nside, append=append)
+    else:
+        data.to_csv(filename, mode="a" if append else "w", header=not append)
+
 
 class DatasetGenerator:
 
@@ -34,19 +105,101 @@ class DatasetGenerator:
         return dset, configs
 
     @staticmethod
-    @cachier(cache_dir=cache_dir, hash_func=model_hash)
+    @cached(hash_func=model_hash)
     def realize_data(survey: skysurvey.Survey, targets: skysurvey.Target, transient_config: Transient, survey_config: Survey):
         logger.info(f"Generating dataset")
-        return PositionalDataset.from_targets_and_survey(targets, survey).data
+        with seeded(config_seed(transient_config, survey_config)):
+            return PositionalDataset.from_targets_and_survey(targets, survey).data
 
-    @property
-    def filenames(self) -> list[Path]:
+    @staticmethod
+    def write_dataset(
+            transient_config: Transient,
+            survey_config: Survey,
+            filename: Path,
+            output_format: OutputFormat = "csv",
+            coarse_nside: int = 16,
+            fine_nside: int = 8192,
+            chunk_size: int | None = None
+    ):
+        survey = SurveyGenerator.survey_dict[survey_config.survey_type].from_config(survey_config)
+        filename.parent.mkdir(exist_ok=True, parents=True)
+        if chunk_size is not None:
+            DatasetGenerator.write_dataset_chunked(
+                survey, transient_config, survey_config, filename, chunk_size, output_format, coarse_nside, fine_nside
+            )
+            return
+        transient = TransientGenerator.transient_classes[transient_config.transient_type]()
+        transient.set_data(TransientGenerator.realize_transient_data(transient_config))
+        data = DatasetGenerator.realize_data(survey, transient, transient_config, survey_config)
+        write_data(data, filename, output_format, coarse_nside, fine_nside)
+        logger.info(f"saved {filename}")
+
+    @staticmethod
+    def write_dataset_chunked(
+            survey: skysurvey.Survey,
+            transient_config: Transient,
+            survey_config: Survey,
+            filename: Path,
+            chunk_size: int,
+            output_format: OutputFormat,
+            coarse_nside: int,
+            fine_nside: int
+    ):
+        """
+        Draw and realize the transients in blocks of chunk_size. The detections are collected until there are
+        FLUSH_ROWS of them and then appended to a temporary file, which replaces filename at the end. So at most
+        FLUSH_ROWS detections plus one block are held in memory, and an interrupted run leaves the previous output
+        untouched. Blocks are seeded independently, so the result depends on chunk_size but not on the number of
+        workers. Nothing is cached.
+        """
+        seed = config_seed(transient_config, survey_config)
+        tmp = filename.with_name(filename.name + ".tmp")
+        pending = []
+        written = False
+
+        def flush():
+            nonlocal written
+            write_data(pd.concat(pending), tmp, output_format, coarse_nside, fine_nside, append=written)
+            logger.info(f"wrote {sum(len(d) for d in pending)} detections to {tmp}")
+            pending.clear()
+            written = True
+
+        for i, targets_data in enumerate(TransientGenerator.iter_transient_blocks(transient_config, chunk_size)):
+            transient = TransientGenerator.transient_classes[transient_config.transient_type]()
+            transient.set_data(targets_data)
+            with seeded(block_seed(seed, i)):
+                data = PositionalDataset.from_targets_and_survey(transient, survey).data
+            logger.info(f"realized block {i} with {len(targets_data)} transients and {len(data)} detections")
+            if len(data) > 0:
+                pending.append(data)
+            if sum(len(d) for d in pending) >= FLUSH_ROWS:
+                flush()
+        if len(pending) > 0:
+            flush()
+
+        if written:
+            # a file is replaced atomically, a parquet directory can only be
+            # renamed once the old one is gone
+            if filename.is_dir():
+                shutil.rmtree(filename)
+            tmp.replace(filename)
+            logger.info(f"saved {filename}")
+        else:
+            remove_output(filename)
+            logger.warning(f"no detections of {transient_config.transient_type} in {survey_config.name}, "
+                           f"nothing written to {filename}")
+
+    def get_filenames(self, output_format: OutputFormat = "csv") -> list[Path]:
         directory = Path(self.config.name)
         return [
-            directory / self.config.get_hash() / f"{s.name}_{t.transient_type}.csv"
+            directory / self.config.get_hash() / f"{s.name}_{t.transient_type}.{output_format}"
             for t, s in itertools.product(self.config.transients, self.config.surveys)
         ]
 
+    @property
+    def filenames(self) -> list[Path]:
+        return self.get_filenames("csv")
+
     @property
     def n_transients(self):
         return len(self.config.transients)
@@ -55,9 +208,55 @@ class DatasetGenerator:
     def n_surveys(self):
         return len(self.config.surveys)
 
-    def write(self):
-        for (d, confs), fname in zip(self, self.filenames):
-            fname.parent.mkdir(exist_ok=True, parents=True)
-            d.data.index.names = ["source_index", "detection_index"]
-            d.data.to_csv(fname)
-            logger.info(f"saved {fname}")
+    def write(
+            self,
+            workers: int = 1,
+            output_format: OutputFormat = "csv",
+            coarse_nside: int = 16,
+            fine_nside: int = 8192,
+            chunk_size: int | None = None
+    ):
+        """
+        Realize and write all (transient, survey) combinations. All random draws are seeded from the configs,
+        so the output does not depend on the number of workers. With output_format "parquet", every combination
+        is written as a dataset partitioned by HEALPix pixel, see write_partitioned. With chunk_size, transients are
+        simulated and written in blocks of that size, see write_dataset_chunked.
+        """
+        if output_format == "parquet":
+            check_nsides(coarse_nside, fine_nside)
+        if chunk_size is not None and any(t.size is None for t in self.config.transients):
+            raise ValueError("chunk_size needs the size of all transients")
+        combinations = list(itertools.product(self.config.transients, self.config.surveys))
+        filenames = self.get_filenames(output_format)
+        options = {
+            "output_format": output_format,
+            "coarse_nside": coarse_nside,
+            "fine_nside": fine_nside,
+            "chunk_size": chunk_size,
+        }
+        if workers == 1:
+            for (transient_config, survey_config), fname in zip(combinations, filenames):
+                self.write_dataset(transient_config, survey_config, fname, **options)
+            return
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # populate the caches first, so that transients and observations are only drawn once
+            futures = [executor.submit(_realize_observations, c) for c in self.config.surveys]
+            if chunk_size is None:
+                futures += [executor.submit(_realize_transients, c) for c in self.config.transients]
+            for f in futures:
+                f.result()
+            futures = [
+                executor.submit(self.write_dataset, transient_config, survey_config, fname, **options)
+                for (transient_config, survey_config), fname in zip(combinations, filenames)
+            ]
+            for f in futures:
+                f.result()
+
+
+def _realize_transients(config: Transient):
+    TransientGenerator.realize_transient_data(config)
+
+
+def _realize_observations(config: Survey):
+    SurveyGenerator.survey_dict[config.survey_type].realize_observations(config)
@@ -1,12 +1,15 @@
 import logging
 import functools
+import hashlib
+import json
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 import pandas as pd
 import requests
 import tarfile
 from pathlib import Path
-from typing import Iterator
-import healpy as hp
+from astropy.io import fits
 
 from ampelmatch.cache import cache_dir
 
@@ -14,6 +17,77 @@ from ampelmatch.cache import cache_dir
 logger = logging.getLogger(__name__)
 
 
+class ResumableStream:
+    """
+    Read-only file-like view of an HTTP download that resumes with a range
+    request when the connection drops, and hashes everything it reads.
+
+    Nothing is written to disk, a download that is given up after
+    ``max_retries`` failed resumes has to start over.
+    """
+
+    def __init__(self, url: str, hash_name: str = "md5", max_retries: int = 5, chunk_size: int = 1 << 16):
+        self.url = url
+        self.max_retries = max_retries
+        self.chunk_size = chunk_size
+        self.position = 0
+        self.hash = hashlib.new(hash_name)
+        self.buffer = b""
+        self.response = None
+        self.chunks = None
+        self.total = None
+        self.progress = None
+        self.connect()
+
+    def connect(self):
+        headers = {"Range": f"bytes={self.position}-"} if self.position > 0 else {}
+        self.response = requests.get(self.url, headers=headers, stream=True, timeout=60)
+        self.response.raise_for_status()
+        if self.position > 0 and self.response.status_code != 206:
+            raise OSError(f"{self.url} does not support range requests, can not resume")
+        if self.progress is None:
+            self.total = int(self.response.headers.get("Content-Length", 0)) or None
+            self.progress = tqdm(total=self.total, unit="B", unit_scale=True, desc=self.url.split("/")[-1])
+        self.chunks = self.response.iter_content(chunk_size=self.chunk_size)
+
+    def next_chunk(self) -> bytes:
+        for attempt in range(self.max_retries + 1):
+            try:
+                chunk = next(self.chunks, b"")
+                break
+            except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f"connection to {self.url} dropped at byte {self.position} ({e}), resuming")
+                self.response.close()
+                self.connect()
+        self.position += len(chunk)
+        if self.progress is not None:
+            self.progress.update(len(chunk))
+        return chunk
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self.buffer) < size:
+            chunk = self.next_chunk()
+            if not chunk:
+                break
+            self.hash.update(chunk)
+            self.buffer += chunk
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def drain(self):
+        while self.read(self.chunk_size):
+            pass
+
+    def close(self):
+        self.response.close()
+        if self.progress is not None:
+            self.progress.close()
+
+
 class IceCubeAlerts:
 
     DATAVERSE_IDS = {
@@ -32,15 +106,48 @@ class IceCubeAlerts:
         2023: 7502707
     }
 
-    def __init__(self):
+    DATAVERSE_URL = "https://dataverse.harvard.edu"
+
+    header_manifest_file = Path(cache_dir) / "icecube_alert_headers.json"
+
+    def __init__(self, base_url: str | None = None, download_workers: int = 4):
         self.data = None
+        self.base_url = (base_url or self.DATAVERSE_URL).rstrip("/")
+        self.download_workers = download_workers
 
-    def load_data(self):
-        _, h = hp.read_map(self.filenames[0], h=True)
+    @staticmethod
+    def read_header(filename: Path) -> dict:
+        # only decompresses the file up to the end of the skymap header
+        logger.debug(f"Reading header of {filename}")
+        header = fits.getheader(filename, ext=1)
+        return {k: v if isinstance(v, (str, int, float, bool)) else str(v) for k, v in header.items()}
+
+    def scan_headers(self, workers: int = 8) -> dict[str, dict]:
+        manifest = {}
+        if self.header_manifest_file.exists():
+            manifest = json.loads(self.header_manifest_file.read_text())
+
+        stats = {str(f): f.stat() for f in self.filenames}
+        changed = [
+            f for f in self.filenames
+            if (str(f) not in manifest)
+            or (manifest[str(f)]["size"] != stats[str(f)].st_size)
+            or (manifest[str(f)]["mtime"] != stats[str(f)].st_mtime)
+        ]
+        logger.info(f"Reading headers of {len(changed)} new or changed IceCube alerts")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            headers = list(tqdm(executor.map(self.read_header, changed), desc="Reading IceCube alerts", total=len(changed)))
+
+        for f, h in zip(changed, headers):
+            manifest[str(f)] = {"size": stats[str(f)].st_size, "mtime": stats[str(f)].st_mtime, "header": h}
+        if len(changed) > 0:
+            self.header_manifest_file.parent.mkdir(exist_ok=True, parents=True)
+            self.header_manifest_file.write_text(json.dumps(manifest))
+        return {str(f): manifest[str(f)]["header"] for f in self.filenames}
+
+    def load_data(self, workers: int = 8):
         data = []
-        for i, f in tqdm(enumerate(self.filenames), desc="Reading IceCube alerts", total=len(self.filenames)):
-            logger.debug(f"Reading {f}")
-            s, h = hp.read_map(f, h=True)
+        for f, h in self.scan_headers(workers).items():
             i_data = dict(h)
             i_data["FILENAME"] = f
             if "GCN_URL" not in i_data:
@@ -53,35 +160,73 @@ class IceCubeAlerts:
 
     @functools.cached_property
     def filenames(self):
-        files = []
-        for year, dataverse_id in self.DATAVERSE_IDS.items():
-            logger.info(f"Getting IceCube alerts for {year}")
-            files.extend(list(self.get_icecube_alerts(dataverse_id)))
-        return files
+        logger.info(f"Getting IceCube alerts for {len(self.DATAVERSE_IDS)} years")
+        with ThreadPoolExecutor(max_workers=self.download_workers) as executor:
+            files = executor.map(self.get_icecube_alerts, self.DATAVERSE_IDS.values())
+            return [f for year_files in files for f in year_files]
 
     def write_data(self, filename: str | Path):
         filename = Path(filename)
         logger.info(f"Writing IceCube alerts to {filename}")
         self.data.to_csv(filename, index=False)
 
-    @staticmethod
-    def get_icecube_alerts(dataverse_id: str) -> Iterator[Path]:
+    def get_checksum(self, dataverse_id: int) -> tuple[str, str] | None:
+        url = f"{self.base_url}/api/files/{dataverse_id}"
+        r = requests.get(url, timeout=60)
+        if not r.ok:
+            logger.warning(f"could not get checksum for {dataverse_id}: {r.status_code}")
+            return None
+        checksum = r.json()["data"]["dataFile"]["checksum"]
+        return checksum["type"].lower().replace("-", ""), checksum["value"]
 
-        tar_dir = Path(cache_dir) / str(dataverse_id)
-
-        if not tar_dir.exists():
-            logger.info("fetching IceCube alerts")
-            cache_file = tar_dir.with_suffix(".tar")
-            url = f"https://dataverse.harvard.edu/api/access/datafile/{dataverse_id}"
-            with requests.get(url, stream=True) as r:
-                with cache_file.open("wb") as f:
-                    for chunk in tqdm(r.iter_content(chunk_size=8192)):
-                        f.write(chunk)
-
-            tar_dir.mkdir(exist_ok=True, parents=True)
-            with tarfile.open(cache_file, "r") as tar:
-                tar.extractall(tar_dir)
+    def get_icecube_alerts(self, dataverse_id: int) -> list[Path]:
 
-            cache_file.unlink()
-
-        return tar_dir.glob("*.fits.gz")
+        tar_dir = Path(cache_dir) / str(dataverse_id)
+        manifest_file = tar_dir / "manifest.json"
+
+        if tar_dir.exists():
+            if manifest_file.exists():
+                manifest = json.loads(manifest_file.read_text())
+                missing = [f for f in manifest["files"] if not (tar_dir / f).exists()]
+                if missing:
+                    raise FileNotFoundError(f"{len(missing)} files of {dataverse_id} missing in {tar_dir}, delete it to refetch")
+            return sorted(tar_dir.glob("*.fits.gz"))
+
+        logger.info(f"fetching IceCube alerts {dataverse_id}")
+        checksum = self.get_checksum(dataverse_id)
+        partial_dir = tar_dir.with_suffix(".partial")
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        partial_dir.mkdir(parents=True)
+
+        # extract straight from the response, no copy of the tarball is kept.
+        # Dropped connections resume with a range request. A run that gives up
+        # starts over in the next one: the state of the decompression and of
+        # the hash can not be stored, and keeping the bytes would mean keeping
+        # the tarball.
+        stream = ResumableStream(
+            f"{self.base_url}/api/access/datafile/{dataverse_id}",
+            hash_name=checksum[0] if checksum else "md5"
+        )
+        try:
+            with tarfile.open(fileobj=stream, mode="r|*") as tar:
+                files = []
+                for member in tar:
+                    tar.extract(member, partial_dir, filter="data")
+                    if member.isfile():
+                        files.append(member.name)
+            stream.drain()
+        except BaseException:
+            shutil.rmtree(partial_dir, ignore_errors=True)
+            raise
+        finally:
+            stream.close()
+
+        digest = stream.hash.hexdigest()
+        if checksum and digest != checksum[1]:
+            shutil.rmtree(partial_dir)
+            raise OSError(f"{checksum[0]} checksum mismatch for {dataverse_id}: {digest} != {checksum[1]}")
+
+        manifest = {"dataverse_id": dataverse_id, "hash_name": stream.hash.name, "hash": digest, "files": files}
+        (partial_dir / "manifest.json").write_text(json.dumps(manifest, indent=4))
+        partial_dir.rename(tar_dir)
+        return sorted(tar_dir.glob("*.fits.gz"))
@@ -1,4 +1,3 @@
-import numpy as np
 import logging
 import skysurvey
 
@@ -21,14 +20,9 @@ class PositionalDataset(skysurvey.DataSet):
         lc_out, fieldids_indexes = super(PositionalDataset, PositionalDataset)._realize_survey_kindtarget_lcs(
             targets, survey, template, template_prop, nfirst, incl_error, client, discard_bands
         )
-        for c in unc.POSITION_KEYS + unc.PARAMETER_KEYS:
-            lc_out[0][c] = np.nan
-
-        for ilc, ifid in zip(lc_out, fieldids_indexes):
-            for target_index in ilc.index.levels[0]:
-                iilc = ilc.loc[target_index]
-                parameters = unc.draw_position(iilc, truth=targets.data.loc[target_index])
-                for c, v in zip(unc.POSITION_KEYS + unc.PARAMETER_KEYS, parameters):
-                    ilc.loc[target_index, c] = v
+        for ilc in lc_out:
+            parameters = unc.draw_positions(ilc, truth_table=targets.data)
+            for c, v in zip(unc.POSITION_KEYS + unc.PARAMETER_KEYS, parameters):
+                ilc[c] = v
 
         return lc_out, fieldids_indexes
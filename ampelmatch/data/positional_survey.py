@@ -3,13 +3,12 @@ import skysurvey
 import numpy as np
 import pandas as pd
 from astropy.time import Time
-from cachier import cachier
 from shapely import geometry
 from abc import ABC, abstractmethod
 
-from ampelmatch.cache import cache_dir, model_hash
+from ampelmatch.cache import cached, model_hash
 from ampelmatch.data.positional_uncertainty import BaseUncertainty
-from ampelmatch.data.config import Survey, PositionalGridSurveyConfig
+from ampelmatch.data.config import Survey, PositionalGridSurveyConfig, config_seed, seeded
 
 
 logger = logging.getLogger(__name__)
@@ -49,17 +48,18 @@ class PositionalGridSurvey(skysurvey.GridSurvey, ObservationRealize):
         return cls.from_pointings(data=data, fields_or_coords=config.fields, uncertainty=uncertainty, footprint=footprint)
 
     @classmethod
-    @cachier(cache_dir=cache_dir, hash_func=model_hash)
+    @cached(hash_func=model_hash)
     def realize_observations(cls, config: PositionalGridSurveyConfig):
         logger.info(f"generating {config.name} observations")
-        data = {
-            "fieldid": np.random.choice(list(config.fields.keys()), size=config.size),
-            "gain": config.gain,
-            "zp": config.zp,
-            "skynoise": np.random.normal(loc=config.skynoise_mean, scale=20, size=config.size),
-            "mjd": np.random.uniform(Time(config.time_min).mjd, Time(config.time_max).mjd, size=config.size),
-            "band": np.random.choice(config.bands, size=config.size)
-        }
+        with seeded(config_seed(config)):
+            data = {
+                "fieldid": np.random.choice(list(config.fields.keys()), size=config.size),
+                "gain": config.gain,
+                "zp": config.zp,
+                "skynoise": np.random.normal(loc=config.skynoise_mean, scale=20, size=config.size),
+                "mjd": np.random.uniform(Time(config.time_min).mjd, Time(config.time_max).mjd, size=config.size),
+                "band": np.random.choice(config.bands, size=config.size)
+            }
         data = pd.DataFrame.from_dict(data)
         logger.info(f"generated {config.size} observations for survey {config.name}")
         return data
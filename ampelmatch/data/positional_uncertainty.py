@@ -16,6 +16,22 @@ class BaseUncertainty:
     def draw_position(self, lc_in: pd.DataFrame, truth: pd.Series) -> tuple:
         ...
 
+    def draw_positions(self, lc: pd.DataFrame, truth_table: pd.DataFrame) -> tuple:
+        """
+        Draw positions for all detections in lc, indexed by (target index, ...).
+        Returns one array per key in POSITION_KEYS + PARAMETER_KEYS, aligned with the rows of lc.
+        This is the slow path: the rows are grouped once, but draw_position is still called in a
+        Python loop over the targets. Subclasses should override it with a vectorized version,
+        like GaussianUncertainty.
+        """
+        columns = [np.full(len(lc), np.nan) for _ in self.POSITION_KEYS + self.PARAMETER_KEYS]
+        groups = lc.groupby(level=0, sort=False).indices
+        for target_index, rows in groups.items():
+            parameters = self.draw_position(lc.iloc[rows], truth=truth_table.loc[target_index])
+            for column, v in zip(columns, parameters):
+                column[rows] = v
+        return tuple(columns)
+
     @classmethod
     def __init_subclass__(cls, **kwargs):
         super().__init_subclass__(**kwargs)
@@ -47,3 +63,16 @@ class GaussianUncertainty(BaseUncertainty):
         ps = np.random.uniform(0, 2 * np.pi, len(lc_in))
         new_coords = coords.directional_offset_by(ps, offsets * u.arcsec)
         return new_coords.ra.deg, new_coords.dec.deg, [self.sigma] * len(lc_in)
+
+    def draw_positions(self, lc: pd.DataFrame, truth_table: pd.DataFrame) -> tuple:
+        truth = truth_table.loc[lc.index.get_level_values(0), ["ra", "dec"]]
+        ra, dec = np.radians(truth["ra"].to_numpy()), np.radians(truth["dec"].to_numpy())
+        r = np.radians(np.random.normal(0, self.sigma, len(lc)) / 3600)
+        pa = np.random.uniform(0, 2 * np.pi, len(lc))
+        # same spherical offset as SkyCoord.directional_offset_by
+        new_dec = np.arcsin(np.sin(dec) * np.cos(r) + np.cos(dec) * np.sin(r) * np.cos(pa))
+        new_ra = ra + np.arctan2(
+            np.sin(pa) * np.sin(r) * np.cos(dec),
+            np.cos(r) - np.sin(dec) * np.sin(new_dec)
+        )
+        return np.degrees(new_ra) % 360, np.degrees(new_dec), np.full(len(lc), self.sigma)
@@ -0,0 +1,151 @@
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+import healpy as hp
+import numpy as np
+import pandas as pd
+
+from ampelmatch.cache import TieredCache
+from ampelmatch.data.config import DatasetConfig
+from ampelmatch.data.dataset import DatasetGenerator, write_data
+from ampelmatch.data.transients import TransientGenerator
+
+logger = logging.getLogger("ampelmatch.data.test_dataset")
+
+
+def write_in(directory: str, config: DatasetConfig, **kwargs) -> dict[Path, bytes]:
+    """
+    Write the dataset in directory, with its own cache, and return the contents
+    of all files
+    """
+    cwd = Path.cwd()
+    os.chdir(directory)
+    # a new default cache, the memory tier of the previous one would hand out
+    # the results of earlier runs
+    TieredCache.default.cache_clear()
+    try:
+        DatasetGenerator(config).write(**kwargs)
+        root = Path(config.name)
+        return {
+            f.relative_to(root): f.read_bytes()
+            for f in sorted(root.rglob("*"))
+            if f.is_file()
+        }
+    finally:
+        os.chdir(cwd)
+
+
+def make_detections(
+    rng: np.random.Generator, n_sources: int, n_detections: int
+) -> pd.DataFrame:
+    index = pd.MultiIndex.from_product([np.arange(n_sources), np.arange(n_detections)])
+    return pd.DataFrame(
+        {
+            "ra": np.repeat(rng.uniform(140, 160, n_sources), n_detections),
+            "dec": np.repeat(rng.uniform(-10, 10, n_sources), n_detections),
+            "mjd": rng.uniform(58900, 58940, len(index)),
+            "flux": rng.normal(1000, 100, len(index)),
+            "fluxerr": rng.uniform(10, 20, len(index)),
+            "fieldid": rng.integers(0, 2, len(index)),
+            "band": rng.choice(["ztfg", "ztfr"], len(index)),
+        },
+        index=index,
+    )
+
+
+if __name__ == "__main__":
+    logging.getLogger("ampelmatch").setLevel("INFO")
+    rng = np.random.default_rng(2)
+
+    # parquet output keeps positions and times at full precision and is
+    # partitioned by the coarse pixel
+    data = make_detections(rng, 500, 4)
+    with tempfile.TemporaryDirectory() as directory:
+        filename = Path(directory) / "detections.parquet"
+        write_data(
+            data.iloc[:1200].copy(),
+            filename,
+            "parquet",
+            coarse_nside=4,
+            fine_nside=1024,
+        )
+        write_data(
+            data.iloc[1200:].copy(),
+            filename,
+            "parquet",
+            coarse_nside=4,
+            fine_nside=1024,
+            append=True,
+        )
+        written = (
+            pd.read_parquet(filename)
+            .sort_values(["source_index", "detection_index"])
+            .reset_index(drop=True)
+        )
+        expected = data.reset_index(drop=True)
+        assert len(written) == len(data)
+        for c in ["ra", "dec", "mjd"]:
+            assert written[c].dtype == "float64" and (written[c] == expected[c]).all()
+        for c in ["flux", "fluxerr"]:
+            assert written[c].dtype == "float32"
+            np.testing.assert_allclose(written[c], expected[c], rtol=1e-6)
+        assert (
+            written["fieldid"].dtype == "int32"
+            and (written["fieldid"] == expected["fieldid"]).all()
+        )
+        assert (written["band"] == expected["band"]).all()
+        fine = hp.ang2pix(1024, expected["ra"], expected["dec"], nest=True, lonlat=True)
+        coarse = hp.ang2pix(4, expected["ra"], expected["dec"], nest=True, lonlat=True)
+        assert (written["hpx_fine"] == fine).all()
+        assert (written["hpx_coarse"].astype(int) == coarse).all()
+        partitions = sorted(p.name for p in filename.glob("hpx_coarse=*"))
+        assert partitions == sorted(f"hpx_coarse={p}" for p in np.unique(coarse))
+        logger.info(
+            f"{len(written)} detections round-trip through {len(partitions)} partitions"
+        )
+
+        for coarse_nside, fine_nside in [(12, 1024), (4, 1000), (64, 16)]:
+            try:
+                write_data(
+                    data.copy(),
+                    filename,
+                    "parquet",
+                    coarse_nside=coarse_nside,
+                    fine_nside=fine_nside,
+                )
+                raise AssertionError(
+                    f"nsides {coarse_nside}, {fine_nside} should be rejected"
+                )
+            except ValueError as e:
+                logger.info(f"rejected: {e}")
+
+    # transients are only drawn in blocks if their number is known
+    config = DatasetConfig.model_validate_json(
+        (Path(__file__).parents[1] / "match" / "test_sim.json").read_text()
+    )
+    unsized = config.transients[0].model_copy(update={"size": None})
+    try:
+        next(TransientGenerator.iter_transient_blocks(unsized, 300))
+        raise AssertionError("blocks without size should be rejected")
+    except ValueError as e:
+        logger.info(f"rejected: {e}")
+
+    # all draws are seeded from the configs, the number of workers does not
+    # change the files
+    for options in [{}, {"chunk_size": 300}]:
+        with tempfile.TemporaryDirectory() as serial_dir:
+            serial = write_in(serial_dir, config, workers=1, **options)
+            n_rows = sum(
+                len(pd.read_csv(Path(serial_dir) / config.name / f)) for f in serial
+            )
+        with tempfile.TemporaryDirectory() as parallel_dir:
+            parallel = write_in(parallel_dir, config, workers=4, **options)
+        assert len(serial) > 0 and serial.keys() == parallel.keys()
+        for f in serial:
+            assert serial[f] == parallel[f], f"{f} differs between 1 and 4 workers"
+        logger.info(
+            f"{options}: {len(serial)} identical files with {n_rows} detections "
+            "for 1 and 4 workers"
+        )
@@ -0,0 +1,181 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import tarfile
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import ClassVar
+
+import healpy as hp
+import numpy as np
+import requests
+
+from ampelmatch.data.icecube_alert import IceCubeAlerts
+
+logger = logging.getLogger("ampelmatch.data.test_icecube_alert")
+
+
+class CountingAlerts(IceCubeAlerts):
+    """Remembers the files whose headers were read"""
+
+    read: ClassVar[list[str]] = []
+
+    @staticmethod
+    def read_header(filename: Path) -> dict:
+        CountingAlerts.read.append(Path(filename).name)
+        return IceCubeAlerts.read_header(filename)
+
+
+class DataverseStandIn(BaseHTTPRequestHandler):
+    """
+    Serves one archive like the Dataverse API, but drops the connection after
+    ``cut_after`` bytes of every response. Once ``budget`` bytes are sent, no
+    more data is served at all. A ``checksum`` replaces the one of the archive.
+    """
+
+    archive = b""
+    cut_after = None
+    budget = None
+    checksum = None
+    range_starts: ClassVar[list[int]] = []
+
+    def send_body(self, status: int, body: bytes, headers: dict):
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        n = len(body) if self.cut_after is None else self.cut_after
+        if self.budget is not None:
+            n = min(n, self.budget)
+            DataverseStandIn.budget -= n
+        self.wfile.write(body[:n])
+        self.close_connection = True
+
+    def do_GET(self):
+        if self.path.startswith("/api/files/"):
+            value = self.checksum or hashlib.md5(self.archive).hexdigest()
+            checksum = {"type": "MD5", "value": value}
+            body = json.dumps({"data": {"dataFile": {"checksum": checksum}}})
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(body.encode())
+            return
+
+        if "Range" not in self.headers:
+            self.send_body(200, self.archive, {})
+            return
+        start = int(self.headers["Range"].removeprefix("bytes=").rstrip("-"))
+        self.range_starts.append(start)
+        if start >= len(self.archive):
+            self.send_response(416)
+            self.end_headers()
+            return
+        content_range = f"bytes {start}-{len(self.archive) - 1}/{len(self.archive)}"
+        self.send_body(206, self.archive[start:], {"Content-Range": content_range})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_archive(files: dict[str, bytes]) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+if __name__ == "__main__":
+    logging.getLogger("ampelmatch").setLevel("INFO")
+    rng = np.random.default_rng(1)
+    files = {f"alert{i}.fits.gz": rng.bytes(200_000) for i in range(5)}
+    DataverseStandIn.archive = make_archive(files)
+    # every response is cut after a tenth of the archive, and the server
+    # stops serving data after half of it
+    DataverseStandIn.cut_after = len(DataverseStandIn.archive) // 10 + 1
+    DataverseStandIn.budget = len(DataverseStandIn.archive) // 2
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), DataverseStandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    alerts = IceCubeAlerts(base_url=f"http://127.0.0.1:{server.server_port}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        cache = Path("ampelmatch_cache")
+
+        # a run that gives up after the retries leaves nothing behind
+        try:
+            alerts.get_icecube_alerts(1)
+            raise AssertionError("download should have been interrupted")
+        except requests.exceptions.RequestException as e:
+            logger.info(f"first run interrupted: {e!r}")
+        assert list(cache.iterdir()) == []
+
+        # an archive that does not match its checksum is removed as well
+        DataverseStandIn.budget = None
+        DataverseStandIn.checksum = hashlib.md5(b"other").hexdigest()
+        try:
+            alerts.get_icecube_alerts(1)
+            raise AssertionError("checksum mismatch should be rejected")
+        except OSError as e:
+            logger.info(f"rejected: {e}")
+        assert list(cache.iterdir()) == []
+
+        # dropped connections resume with range requests, the extracted files
+        # are the only copy of the archive on disk
+        DataverseStandIn.checksum = None
+        DataverseStandIn.range_starts.clear()
+        filenames = alerts.get_icecube_alerts(1)
+        starts = DataverseStandIn.range_starts
+        assert len(starts) >= 9 and starts == sorted(starts)
+        assert sorted(f.name for f in filenames) == sorted(files)
+        for f in filenames:
+            assert f.read_bytes() == files[f.name], f"{f} differs"
+        assert [p.name for p in cache.iterdir()] == ["1"]
+        assert sorted(p.name for p in (cache / "1").iterdir()) == sorted(
+            [*files, "manifest.json"]
+        )
+        manifest = json.loads((cache / "1" / "manifest.json").read_text())
+        assert manifest["hash"] == hashlib.md5(DataverseStandIn.archive).hexdigest()
+        logger.info(
+            f"{len(starts)} range requests, {len(filenames)} files match the archive"
+        )
+        os.chdir(Path(__file__).parent)
+    server.shutdown()
+
+    # headers are read in threads once, only changed files are read again
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        skymaps = []
+        for i in range(6):
+            skymaps.append(Path(f"alert{i}.fits.gz").resolve())
+            hp.write_map(skymaps[-1], np.zeros(12), extra_header=[("RUNID", i)])
+        alerts = CountingAlerts()
+        alerts.filenames = skymaps
+        headers = alerts.scan_headers(workers=3)
+        assert sorted(CountingAlerts.read) == sorted(f.name for f in skymaps)
+        assert [h["RUNID"] for h in headers.values()] == list(range(6))
+
+        CountingAlerts.read.clear()
+        alerts = CountingAlerts()
+        alerts.filenames = skymaps
+        alerts.scan_headers(workers=3)
+        assert CountingAlerts.read == []
+
+        stat = skymaps[2].stat()
+        os.utime(skymaps[2], (stat.st_atime, stat.st_mtime + 10))
+        alerts = CountingAlerts()
+        alerts.filenames = skymaps
+        alerts.load_data(workers=3)
+        assert CountingAlerts.read == [skymaps[2].name]
+        assert alerts.data["runid"].tolist() == list(range(6))
+        logger.info(f"{len(skymaps)} headers scanned, only the touched one re-read")
+        os.chdir(Path(__file__).parent)
@@ -1,9 +1,8 @@
 import logging
 import skysurvey
-from cachier import cachier
 
-from ampelmatch.cache import cache_dir, model_hash
-from ampelmatch.data.config import Transient
+from ampelmatch.cache import cached, model_hash
+from ampelmatch.data.config import Transient, block_seed, config_seed, seeded
 
 
 logger = logging.getLogger(__name__)
@@ -19,21 +18,48 @@ class TransientGenerator:
         self.iter_config = iter(configs)
 
     @staticmethod
-    @cachier(cache_dir=cache_dir, hash_func=model_hash)
+    @cached(hash_func=model_hash)
     def realize_transient_data(config):
         logger.info(f"Generating {config}")
         transient = TransientGenerator.transient_classes[config.transient_type]()
-        transient.draw(
-            size=config.size,
-            tstart=config.tstart,
-            tstop=config.tstop,
-            zmax=config.zmax,
-            skyarea=config.skyarea,
-            inplace=True
-        )
+        with seeded(config_seed(config)):
+            transient.draw(
+                size=config.size,
+                tstart=config.tstart,
+                tstop=config.tstop,
+                zmax=config.zmax,
+                skyarea=config.skyarea,
+                inplace=True
+            )
         logger.info(f"Generated {len(transient.data)} {config.transient_type} transients")
         return transient.data
 
+    @staticmethod
+    def iter_transient_blocks(config, block_size: int):
+        """
+        Draw the transients of config in blocks of at most block_size, without caching them. Every block is seeded
+        from the config and its number, the index continues across blocks.
+        """
+        if config.size is None:
+            raise ValueError(f"{config.transient_type} transients need a size to be drawn in blocks")
+        seed = config_seed(config)
+        for i, start in enumerate(range(0, config.size, block_size)):
+            size = min(block_size, config.size - start)
+            transient = TransientGenerator.transient_classes[config.transient_type]()
+            with seeded(block_seed(seed, i)):
+                transient.draw(
+                    size=size,
+                    tstart=config.tstart,
+                    tstop=config.tstop,
+                    zmax=config.zmax,
+                    skyarea=config.skyarea,
+                    inplace=True
+                )
+            data = transient.data
+            data.index = data.index + start
+            logger.debug(f"Generated block {i} of {config.transient_type} transients {start} to {start + size}")
+            yield data
+
     def __iter__(self):
         logger.info("Making test transients")
         return self
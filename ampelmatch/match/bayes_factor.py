@@ -1,9 +1,8 @@
 import abc
 import functools
-import json
 import logging
 from pathlib import Path
-from typing import Any, Dict, Union, Literal
+from typing import Any, ClassVar, Dict, Union, Literal
 
 import astropy.units as u
 import healpy as hp
@@ -11,6 +10,10 @@ import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 from ampelmatch.cache import dataframe_hash
+from ampelmatch.match.contour_store import ContourStore
+from ampelmatch.match.pair_table import PairTable
+from ampelmatch.match.parallel import evaluate_sharded
+from ampelmatch.match.spatial_index import ContourIndex, HealpixIndex, KDTreeIndex
 from astropy.coordinates import angular_separation, SkyCoord
 from ligo.skymap import plot as ligo_plot
 from matplotlib import cm, colors
@@ -20,6 +23,7 @@ from pydantic import (
     model_validator,
     PositiveInt,
 )
+from scipy import sparse
 from tqdm import tqdm
 
 logger = logging.getLogger(__name__)
@@ -32,8 +36,16 @@ class BaseBayesFactor(BaseModel, abc.ABC):
     match_type: str
     nside: int
     model_config = ConfigDict(arbitrary_types_allowed=True)
+    # columns read from the catalogs, missing ones are skipped
+    primary_columns: ClassVar[list[str]] = ["ra", "dec", "sigma_arcsec"]
+    match_columns: ClassVar[list[str]] = ["ra", "dec", "sigma_arcsec", "source_index"]
+    # upper limit of candidate pairs evaluated at once without a disc radius
+    max_batch_pairs: ClassVar[int] = 10_000_000
 
     disc_radius_arcsec: float | None = 100
+    candidate_engine: Literal["healpix", "kdtree"] = "healpix"
+    batch: bool = False
+    workers: PositiveInt = 1
     plot: bool | PositiveInt = False
     plot_indices: list[Any] | None = None
     plot_dir: Path | None = None
@@ -77,16 +89,48 @@ class BaseBayesFactor(BaseModel, abc.ABC):
             values["plot_dir"] = Path(values["name"]) / "plots"
         return values
 
-    def get_pixels_disc(self, ra, dec):
-        vec = hp.ang2vec(ra, dec, lonlat=True)
-        return hp.query_disc(
-            nside=self.nside, vec=vec, radius=np.radians(self.disc_radius_arcsec / 3600)
-        )
-
-    def get_pixel(self, ra, dec):
-        return list(hp.get_all_neighbours(self.nside, ra, dec, lonlat=True)) + [
-            hp.ang2pix(self.nside, ra, dec, lonlat=True)
-        ]
+    @model_validator(mode="after")
+    def check_candidate_engine(self):
+        if self.candidate_engine == "kdtree" and self.disc_radius_arcsec is None:
+            raise ValueError("kdtree candidate engine requires disc_radius_arcsec")
+        return self
+
+    def search_nside(self) -> int:
+        """
+        Resolution at which the pixel of a position and its neighbours cover the
+        disc around it. Pixels are not square, so they have to be twice as large
+        as the disc radius.
+        """
+        nside = self.nside
+        while nside > 1 and hp.nside2resol(nside, arcmin=True) < (
+            2 * self.disc_radius_arcsec / 60
+        ):
+            nside //= 2
+        return nside
+
+    def search_pixels(self, ra, dec) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Unique NESTED pixels at ``search_nside`` around each position, and the
+        position each pixel belongs to
+        """
+        nside = self.search_nside()
+        ra, dec = np.atleast_1d(ra), np.atleast_1d(dec)
+        pixels = np.vstack(
+            [
+                hp.get_all_neighbours(nside, ra, dec, nest=True, lonlat=True),
+                hp.ang2pix(nside, ra, dec, nest=True, lonlat=True),
+            ]
+        ).T.flatten()
+        position = np.repeat(np.arange(len(ra)), 9)
+
+        # drop missing neighbours and pixels that appear twice for one position
+        m = pixels >= 0
+        pixels, position = pixels[m], position[m]
+        order = np.lexsort((pixels, position))
+        pixels, position = pixels[order], position[order]
+        first = np.ones(len(pixels), dtype=bool)
+        first[1:] = (np.diff(pixels) != 0) | (np.diff(position) != 0)
+        return pixels[first], position[first]
 
     @abc.abstractmethod
     def calculate_bayes_factors(
@@ -156,51 +200,125 @@ class BaseBayesFactor(BaseModel, abc.ABC):
         logger.debug(f"saved plot to {fname}")
         plt.close()
 
-    def disc_selection(self, match_data, ra, dec):
-        match_data_hp_maps = []
-        logger.debug("calculating healpix maps for disc selection")
-        for m in match_data:
-            match_data_hp_maps.append(
-                pd.Series(
-                    m.index,
-                    index=hp.ang2pix(self.nside, m["ra"], m["dec"], lonlat=True),
-                )
-            )
+    def build_spatial_indices(
+        self, match_data: list[pd.DataFrame]
+    ) -> list[HealpixIndex | KDTreeIndex]:
+        logger.debug(f"building {self.candidate_engine} indices for disc selection")
+        if self.candidate_engine == "kdtree":
+            return [KDTreeIndex(m) for m in match_data]
+        return [HealpixIndex(m, self.nside) for m in match_data]
 
-        if (
-            r := hp.pixelfunc.nside2resol(self.nside, arcmin=True)
-        ) < self.disc_radius_arcsec / 60:
-            logger.debug(
-                "healpix resolution is better than disc radius, using query_disc"
-            )
-            primary_hp_index = self.get_pmatchixels_disc(ra, dec)
-        else:
-            logger.debug(
-                f"healpix resolution {r} arcmin is worse than "
-                f"disc radius {self.disc_radius_arcsec} arcsec, using only primary pixel"
-            )
-            primary_hp_index = self.get_pixel(ra, dec)
+    def disc_selection(
+        self,
+        match_data: list[pd.DataFrame],
+        ra: float,
+        dec: float,
+        spatial_indices: list[HealpixIndex | KDTreeIndex],
+    ) -> list[pd.DataFrame]:
+        if self.candidate_engine == "kdtree":
+            return [
+                m.iloc[index.query_pairs(ra, dec, self.disc_radius_arcsec)[1]]
+                for m, index in zip(match_data, spatial_indices)
+            ]
 
+        pixels, _ = self.search_pixels(ra, dec)
         selected_data = []
-        for m, mh in zip(match_data, match_data_hp_maps):
-            pixels_in_search_region_with_sources = mh.index.intersection(
-                primary_hp_index
-            )
-            if len(pixels_in_search_region_with_sources) == 0:
-                continue
-            hpi = mh.loc[pixels_in_search_region_with_sources]
-            logger.debug(f"selected {len(hpi)} sources")
-            selected_data.append(m.loc[hpi])
+        for m, index in zip(match_data, spatial_indices):
+            rows = index.query(pixels, self.search_nside())
+            logger.debug(f"selected {len(rows)} sources")
+            selected_data.append(m.iloc[rows])
 
         return selected_data
 
-    def evaluate(self, primary_data: pd.DataFrame, match_data: list[pd.DataFrame]):
+    def halo_arcsec(self) -> float | None:
+        """
+        Maximal distance of a candidate from its primary source, None if every
+        secondary source is a candidate.
+        """
+        if self.disc_radius_arcsec is None:
+            return None
+        if self.candidate_engine == "kdtree":
+            return self.disc_radius_arcsec
+        pixel_margin = np.degrees(hp.max_pixrad(self.nside)) * 3600
+        return self.disc_radius_arcsec + 4 * pixel_margin
+
+    def primary_source_positions(self, primary_data: pd.DataFrame) -> pd.DataFrame:
+        columns = [c for c in ["ra", "dec", "sigma_arcsec"] if c in primary_data]
+        return primary_data[columns].groupby(level=0, sort=False).median()
+
+    def candidate_pairs(
+        self,
+        primary_sources: pd.DataFrame,
+        match_data: pd.DataFrame,
+        spatial_index: HealpixIndex | KDTreeIndex | None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Positional indices of all (primary source, secondary row) pairs that
+        fall into the search region of the primary source.
+        """
+        n_primary = len(primary_sources)
+        if spatial_index is None:
+            iprimary = np.repeat(np.arange(n_primary), len(match_data))
+            rows = np.tile(np.arange(len(match_data)), n_primary)
+            return iprimary, rows
+
+        ra = primary_sources["ra"].to_numpy()
+        dec = primary_sources["dec"].to_numpy()
+        if isinstance(spatial_index, KDTreeIndex):
+            return spatial_index.query_pairs(ra, dec, self.disc_radius_arcsec)
+
+        pixels, pixel_primary = self.search_pixels(ra, dec)
+        start, stop = spatial_index.query_ranges(pixels, self.search_nside())
+        counts = stop - start
+        iprimary = np.repeat(pixel_primary, counts)
+        positions = np.repeat(start - np.cumsum(counts) + counts, counts) + np.arange(
+            counts.sum()
+        )
+        return iprimary, spatial_index.order[positions]
+
+    @abc.abstractmethod
+    def calculate_bayes_factors_batch(
+        self,
+        primary_sources: pd.DataFrame,
+        iprimary: np.ndarray,
+        match_data: pd.DataFrame,
+        rows: np.ndarray,
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]: ...
+
+    def plot_source(
+        self,
+        primary_source_id,
+        i_primary_data: pd.DataFrame,
+        bayes_factors: dict[int, pd.Series],
+        match_data: list[pd.DataFrame],
+    ):
+        fig, ax, axs = self.setup_plot(i_primary_data, len(match_data))
+        for imd, bf in bayes_factors.items():
+            bf = bf[bf > 0]
+            orig_sources = match_data[imd].loc[bf.index]
+            orig_sources.loc[:, "marker"] = "s"
+            orig_sources.loc[:, "woe"] = np.log10(bf)
+            self.add_data_to_plot(
+                ax, orig_sources, "woe", self.cmaps[imd], f"WOE {imd}", axs[imd]
+            )
+        self.finalize_plot(fig, ax, primary_source_id)
+
+    def evaluate(
+        self,
+        primary_data: pd.DataFrame,
+        match_data: list[pd.DataFrame],
+        spatial_indices: list[HealpixIndex | KDTreeIndex] | None = None,
+        workers: int | None = None,
+    ) -> PairTable:
         logger.info("Matching streams")
-        n_secondary = len(match_data)
+        workers = workers or self.workers
 
-        # Perform matching
-        logger.info("matching ...")
-        primary_source_bayes_factors = {}
+        if (
+            self.disc_radius_arcsec is not None
+            and spatial_indices is None
+            and workers == 1
+        ):
+            spatial_indices = self.build_spatial_indices(match_data)
 
         if self.plot_indices is None:
             if self.plot:
@@ -210,6 +328,75 @@ class BaseBayesFactor(BaseModel, abc.ABC):
             else:
                 self.plot_indices = []
 
+        # Perform matching
+        logger.info("matching ...")
+        if workers > 1:
+            bayes_factors = evaluate_sharded(self, primary_data, match_data, workers)
+        elif self.batch:
+            bayes_factors = self.evaluate_batch(
+                primary_data, match_data, spatial_indices
+            )
+        else:
+            # label the secondary rows by position, catalogs may repeat labels
+            positional = []
+            for md in match_data:
+                positional.append(md.copy(deep=False))
+                positional[-1].index = pd.RangeIndex(len(md))
+            bayes_factors = PairTable.from_dict(
+                self.evaluate_per_source(primary_data, positional, spatial_indices),
+                [md.index for md in match_data],
+                by_position=True,
+            )
+
+        for primary_source_id in self.plot_indices:
+            self.plot_source(
+                primary_source_id,
+                primary_data.loc[primary_source_id],
+                bayes_factors.source(primary_source_id),
+                match_data,
+            )
+
+        return bayes_factors
+
+    def evaluate_batch(
+        self,
+        primary_data: pd.DataFrame,
+        match_data: list[pd.DataFrame],
+        spatial_indices: list[HealpixIndex | KDTreeIndex] | None,
+    ) -> PairTable:
+        primary_sources = self.primary_source_positions(primary_data)
+
+        pairs = []
+        for imd, md in enumerate(match_data):
+            logger.debug(f"evaluating catalog {imd} in batch mode")
+            index = spatial_indices[imd] if spatial_indices is not None else None
+            # without an index every pair is a candidate, bound the pairs per step
+            step = max(len(primary_sources), 1)
+            if index is None:
+                step = max(1, self.max_batch_pairs // max(len(md), 1))
+            chunks = []
+            for start in range(0, max(len(primary_sources), 1), step):
+                chunk = primary_sources.iloc[start : start + step]
+                iprimary, rows = self.candidate_pairs(chunk, md, index)
+                iprimary, rows, bf = self.calculate_bayes_factors_batch(
+                    chunk, iprimary, md, rows
+                )
+                chunks.append((iprimary + start, rows, bf))
+            pairs.append(tuple(np.concatenate(c) for c in zip(*chunks)))
+            logger.debug(f"{len(pairs[-1][0])} pairs in catalog {imd}")
+
+        return PairTable.from_arrays(
+            primary_sources.index, [md.index for md in match_data], pairs
+        )
+
+    def evaluate_per_source(
+        self,
+        primary_data: pd.DataFrame,
+        match_data: list[pd.DataFrame],
+        spatial_indices: list[HealpixIndex | KDTreeIndex] | None,
+    ):
+        primary_source_bayes_factors = {}
+
         for primary_source_id in tqdm(
             primary_data.index.unique(), desc="primary sources"
         ):
@@ -221,12 +408,9 @@ class BaseBayesFactor(BaseModel, abc.ABC):
                 primary_mean_ra = i_primary_data["ra"].median()
                 primary_mean_dec = i_primary_data["dec"].median()
 
-            if primary_source_id in self.plot_indices:
-                fig, ax, axs = self.setup_plot(i_primary_data, n_secondary)
-
             if self.disc_radius_arcsec is not None:
                 selected_match_data = self.disc_selection(
-                    match_data, primary_mean_ra, primary_mean_dec
+                    match_data, primary_mean_ra, primary_mean_dec, spatial_indices
                 )
             else:
                 selected_match_data = match_data
@@ -237,26 +421,22 @@ class BaseBayesFactor(BaseModel, abc.ABC):
                 bayes_factors[imd] = self.calculate_bayes_factors(
                     primary_mean_ra, primary_mean_dec, i_primary_data, md
                 )
-                if primary_source_id in self.plot_indices:
-                    bf = bayes_factors[imd]
-                    bf = bf[bf > 0]
-                    orig_sources = md.loc[bf.index]
-                    orig_sources.loc[:, "marker"] = "s"
-                    orig_sources.loc[:, "woe"] = np.log10(bf)
-                    self.add_data_to_plot(
-                        ax, orig_sources, "woe", self.cmaps[imd], f"WOE {imd}", axs[imd]
-                    )
 
             primary_source_bayes_factors[primary_source_id] = bayes_factors
 
-            if primary_source_id in self.plot_indices:
-                self.finalize_plot(fig, ax, primary_source_id)
-
         return primary_source_bayes_factors
 
 
 class GaussianBayesFactor(BaseBayesFactor):
     match_type: Literal["gaussian"]
+    batch: bool = True
+
+    @staticmethod
+    def bayes_factor(
+        psi_arcsec: np.ndarray, primary_sigma_arcsec, sigmas_arcsec
+    ) -> np.ndarray:
+        ssum = primary_sigma_arcsec**2 + sigmas_arcsec**2
+        return 2 / ssum * np.exp(-(psi_arcsec**2) / (2 * ssum)) / SQARCSEC_TO_SR
 
     def calculate_bayes_factors(
         self,
@@ -286,9 +466,38 @@ class GaussianBayesFactor(BaseBayesFactor):
             psi_arcsec = psi_arcsec[m]
 
         sigmas_arcsec = orig_sources["sigma_arcsec"]
-        primary_sigma_arcsec = primary_data["sigma_arcsec"].median()
-        ssum = primary_sigma_arcsec**2 + sigmas_arcsec**2
-        return 2 / ssum * np.exp(-(psi_arcsec**2) / (2 * ssum)) / SQARCSEC_TO_SR
+        primary_sigma_arcsec = np.median(primary_data["sigma_arcsec"])
+        return self.bayes_factor(psi_arcsec, primary_sigma_arcsec, sigmas_arcsec)
+
+    def calculate_bayes_factors_batch(
+        self,
+        primary_sources: pd.DataFrame,
+        iprimary: np.ndarray,
+        match_data: pd.DataFrame,
+        rows: np.ndarray,
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        psi_rad = angular_separation(
+            *[
+                np.radians(v)
+                for v in [
+                    primary_sources["ra"].to_numpy()[iprimary],
+                    primary_sources["dec"].to_numpy()[iprimary],
+                    match_data["ra"].to_numpy()[rows],
+                    match_data["dec"].to_numpy()[rows],
+                ]
+            ]
+        )
+        psi_arcsec = np.degrees(psi_rad) * 3600
+
+        if self.disc_radius_arcsec is not None:
+            m = psi_arcsec < self.disc_radius_arcsec
+            logger.debug(f"{m.sum()} pairs within disc")
+            iprimary, rows, psi_arcsec = iprimary[m], rows[m], psi_arcsec[m]
+
+        sigmas_arcsec = match_data["sigma_arcsec"].to_numpy()[rows]
+        primary_sigma_arcsec = primary_sources["sigma_arcsec"].to_numpy()[iprimary]
+        bf = self.bayes_factor(psi_arcsec, primary_sigma_arcsec, sigmas_arcsec)
+        return iprimary, rows, bf
 
     def setup_plot(
         self, primary_data: pd.DataFrame, n_secondary: int
@@ -321,44 +530,21 @@ class GaussianBayesFactor(BaseBayesFactor):
 
 class IceCubeContourBayesFactor(BaseBayesFactor):
     match_type: Literal["icecube_contour"]
+    match_columns: ClassVar[list[str]] = ["ra", "dec", "nside", "filename"]
     disc_radius_arcsec: None = None
+    batch: bool = True
     contour_cache: dict = {}
 
     @staticmethod
     @functools.cache
     def contour_pixels_indices(filename: str | Path):
-        filename = Path(filename).resolve()
-        cache_file = filename.with_suffix(".cache")
-        if not cache_file.exists():
-            logger.debug(f"{cache_file} does not exist, calculating contour pixels")
-            s, h = hp.read_map(filename, h=True)
-            h = dict(h)
-            if "Wilks theorem" in h["COMMENTS"]:
-                llh_level = 4.605170185988092
-            else:
-                llh_level = 64.2
-            ctr_pix = np.where(s < llh_level)[0]
-            ctr_area = len(ctr_pix) * hp.nside2pixarea(h["NSIDE"])
-            res_str = json.dumps(
-                {
-                    "ctr_pix": ctr_pix.tolist(),
-                    "ctr_area": ctr_area,
-                    "llh_level": llh_level,
-                }
-            )
-            cache_file.write_text(res_str)
-            logger.debug(f"saved contour pixels to {cache_file}")
-        else:
-            logger.debug(f"reading contour pixels from {cache_file}")
-            res = json.loads(cache_file.read_text())
-            ctr_pix = np.array(res["ctr_pix"])
-            ctr_area = res["ctr_area"]
-            llh_level = res["llh_level"]
+        ctr_pix, ctr_area, llh_level = ContourStore.default().get(filename)
         logger.debug(f"{filename}: {ctr_area / SQDG_TO_SR} sqd")
         return ctr_pix, ctr_area, llh_level
 
-    def get_contour_cache(self, data):
-        h = dataframe_hash(data)
+    def get_contour_cache(self, data) -> dict[int, tuple[ContourIndex, pd.DataFrame]]:
+        # RA scrambles only change ra and ra_offset, they share the cache
+        h = dataframe_hash(data[["nside", "filename"]])
         if h not in self.contour_cache:
             logger.info("making contour cache")
             nsides = data["nside"].unique()
@@ -367,23 +553,28 @@ class IceCubeContourBayesFactor(BaseBayesFactor):
             for nside in nsides:
                 m = data["nside"] == nside
                 logger.debug(f"nside {nside}: {m.sum()} sources")
-                pixels = {i: [] for i in range(hp.nside2npix(nside))}
+                contours = [
+                    self.contour_pixels_indices(fn) for fn in data.loc[m, "filename"]
+                ]
+                ctr_area = np.array([c[1] for c in contours], dtype=float)
+                # dec band of each contour, padded by the pixel radius
+                pad = np.degrees(hp.max_pixrad(nside))
+                dec_bands = [
+                    hp.pix2ang(nside, c[0], lonlat=True)[1] if len(c[0]) else [np.nan]
+                    for c in contours
+                ]
                 values = pd.DataFrame(
+                    {
+                        "bayes_factor_in": 0.9 * (4 * np.pi) / ctr_area,
+                        "bayes_factor_out": 0.1 / (1 - ctr_area / (4 * np.pi)),
+                        "row": np.flatnonzero(m),
+                        "dec_min": [np.min(d) - pad for d in dec_bands],
+                        "dec_max": [np.max(d) + pad for d in dec_bands],
+                    },
                     index=data[m].index,
-                    columns=["bayes_factor_in", "bayes_factor_out"],
-                    dtype=float,
                 )
-                for i, r in data[m].iterrows():
-                    ctr_pix, ctr_area, llh_level = self.contour_pixels_indices(
-                        r["filename"]
-                    )
-                    values.loc[i, "bayes_factor_in"] = 0.9 * (4 * np.pi) / ctr_area
-                    values.loc[i, "bayes_factor_out"] = 0.1 / (
-                        1 - ctr_area / (4 * np.pi)
-                    )
-                    for p in ctr_pix:
-                        pixels[p].append(i)
-                cache_dict[nside] = (pixels, values)
+                index = ContourIndex([c[0] for c in contours])
+                cache_dict[nside] = (index, values)
             self.contour_cache[h] = cache_dict
         return self.contour_cache[h]
 
@@ -394,13 +585,21 @@ class IceCubeContourBayesFactor(BaseBayesFactor):
         primary_data: pd.DataFrame,
         orig_sources: pd.DataFrame,
     ) -> pd.Series:
+        if "ra_offset" in orig_sources.columns:
+            in_matrix, bayes_factors_out = self.contour_bayes_factor_matrix(
+                np.atleast_1d(primary_ra), np.atleast_1d(primary_dec), orig_sources
+            )
+            bayes_factors_out[in_matrix.indices] = in_matrix.data
+            return pd.Series(bayes_factors_out, index=orig_sources.index)
+
         bayes_factors = pd.Series(0.0, index=orig_sources.index)
         contour_cache = self.get_contour_cache(orig_sources)
         pix_indices = np.atleast_1d(
             hp.ang2pix(list(contour_cache.keys()), primary_ra, primary_dec, lonlat=True)
         )
-        for pix_index, (pixels, values) in zip(pix_indices, contour_cache.values()):
-            in_indices = pixels[pix_index]
+        for pix_index, (index, values) in zip(pix_indices, contour_cache.values()):
+            _, in_contours = index.query(pix_index)
+            in_indices = values.index[in_contours]
             out_indices = values.index.difference(in_indices)
             for i, s in zip([in_indices, out_indices], ["in", "out"]):
                 if len(i) > 0:
@@ -408,6 +607,95 @@ class IceCubeContourBayesFactor(BaseBayesFactor):
                     bayes_factors.loc[i] = values.loc[i, f"bayes_factor_{s}"]
         return bayes_factors
 
+    def contour_bayes_factor_matrix(
+        self, ra: np.ndarray, dec: np.ndarray, data: pd.DataFrame
+    ) -> tuple[sparse.csr_matrix, np.ndarray]:
+        """
+        Bayes factors of all positions against all contours in ``data``: a sparse
+        (n_positions, n_contours) matrix holding the Bayes factors of the
+        contours that contain the position, and the dense Bayes factors for
+        positions outside of each contour.
+        """
+        contour_cache = self.get_contour_cache(data)
+        bayes_factors_out = np.empty(len(data))
+        iprimary, icontour, bayes_factors_in = [], [], []
+        for nside, (index, values) in contour_cache.items():
+            rows = values["row"].to_numpy()
+            if "ra_offset" in data.columns:
+                ra_offset = data["ra_offset"].to_numpy()[rows]
+                i_iprimary, in_contours = self.shifted_contour_pairs(
+                    ra, dec, ra_offset, nside, index, values
+                )
+            else:
+                pixels = hp.ang2pix(nside, ra, dec, lonlat=True)
+                i_iprimary, in_contours = index.query(pixels)
+            bayes_factors_out[rows] = values["bayes_factor_out"].to_numpy()
+            iprimary.append(i_iprimary)
+            icontour.append(rows[in_contours])
+            bayes_factors_in.append(values["bayes_factor_in"].to_numpy()[in_contours])
+            logger.debug(f"nside {nside}: {len(i_iprimary)} positions inside contours")
+
+        in_matrix = sparse.csr_matrix(
+            (
+                np.concatenate(bayes_factors_in),
+                (np.concatenate(iprimary), np.concatenate(icontour)),
+            ),
+            shape=(len(ra), len(data)),
+        )
+        return in_matrix, bayes_factors_out
+
+    @staticmethod
+    def shifted_contour_pairs(
+        ra: np.ndarray,
+        dec: np.ndarray,
+        ra_offset: np.ndarray,
+        nside: int,
+        index: ContourIndex,
+        values: pd.DataFrame,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        All (position, contour) pairs where the contour, moved by its
+        ``ra_offset``, contains the position. Only positions in the dec band of
+        a contour are tested, by moving them back by the offset.
+        """
+        order = np.argsort(dec)
+        lo = np.searchsorted(dec[order], values["dec_min"].to_numpy(), side="left")
+        hi = np.searchsorted(dec[order], values["dec_max"].to_numpy(), side="right")
+        counts = np.maximum(hi - lo, 0)
+        contours = np.repeat(np.arange(len(values)), counts)
+        candidates = order[
+            np.repeat(lo - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        ]
+        pixels = hp.ang2pix(
+            nside, ra[candidates] - ra_offset[contours], dec[candidates], lonlat=True
+        )
+        inside = index.contains(contours, pixels)
+        return candidates[inside], contours[inside]
+
+    def calculate_bayes_factors_batch(
+        self,
+        primary_sources: pd.DataFrame,
+        iprimary: np.ndarray,
+        match_data: pd.DataFrame,
+        rows: np.ndarray,
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        in_matrix, bayes_factors_out = self.contour_bayes_factor_matrix(
+            primary_sources["ra"].to_numpy(),
+            primary_sources["dec"].to_numpy(),
+            match_data,
+        )
+        bf = bayes_factors_out[rows]
+        if len(bf) == 0:
+            return iprimary, rows, bf
+        in_pairs = in_matrix.tocoo()
+        pair_keys = iprimary * len(match_data) + rows
+        in_keys = in_pairs.row * len(match_data) + in_pairs.col
+        order = np.argsort(pair_keys, kind="stable")
+        pos = np.minimum(np.searchsorted(pair_keys[order], in_keys), len(bf) - 1)
+        found = pair_keys[order][pos] == in_keys
+        bf[order[pos[found]]] = in_pairs.data[found]
+        return iprimary, rows, bf
+
     def setup_plot(
         self, primary_data: pd.DataFrame, n_secondary: int
     ) -> tuple[plt.Figure, plt.Axes, list[plt.Axes]]:
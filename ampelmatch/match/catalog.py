@@ -0,0 +1,283 @@
+import functools
+import json
+import logging
+import threading
+from collections.abc import Iterator
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from fastparquet import ParquetFile
+
+from ampelmatch.cache import file_fingerprint, register_fingerprint
+
+logger = logging.getLogger(__name__)
+
+PARQUET_SUFFIXES = [".parquet", ".pq", ".parq"]
+SCHEMA = {
+    "ra": "float64",
+    "dec": "float64",
+    "sigma_arcsec": "float64",
+    "nside": "int64",
+}
+# read_csv options that do not apply when only the header is read
+CSV_PROBE_EXCLUDED = {"index_col", "nrows", "skipfooter", "chunksize", "iterator"}
+
+
+def is_parquet(spec: dict) -> bool:
+    if "format" in spec:
+        return spec["format"] == "parquet"
+    path = Path(spec["filepath_or_buffer"])
+    return (path.suffix in PARQUET_SUFFIXES) or path.is_dir()
+
+
+def region_filters(spec: dict) -> list[tuple]:
+    """
+    Row group filters from the ``region`` ({"ra": [min, max], "dec": [min, max]})
+    and ``time`` ({"column": name, "range": [min, max]}) entries of a spec
+    """
+    filters = list(spec.get("filters", []))
+    for c, (vmin, vmax) in spec.get("region", {}).items():
+        filters += [(c, ">=", vmin), (c, "<=", vmax)]
+    if "time" in spec:
+        vmin, vmax = spec["time"]["range"]
+        filters += [
+            (spec["time"]["column"], ">=", vmin),
+            (spec["time"]["column"], "<=", vmax),
+        ]
+    return filters
+
+
+def apply_filters(data: pd.DataFrame, filters: list[tuple]) -> pd.DataFrame:
+    """Exact row selection, the parquet reader only prunes whole row groups"""
+    if len(filters) == 0:
+        return data
+    m = np.ones(len(data), dtype=bool)
+    operators = {
+        "==": np.equal,
+        "!=": np.not_equal,
+        ">=": np.greater_equal,
+        "<=": np.less_equal,
+        ">": np.greater,
+        "<": np.less,
+    }
+    for c, op, v in filters:
+        if c == data.index.name:
+            values = data.index
+        elif c in data.columns:
+            values = data[c]
+        else:
+            # partition columns are not read, their row groups are already exact
+            continue
+        if op == "in":
+            m &= np.isin(values, v)
+        elif op == "not in":
+            m &= ~np.isin(values, v)
+        else:
+            m &= operators[op](values, v)
+    return data[m]
+
+
+def apply_schema(data: pd.DataFrame) -> pd.DataFrame:
+    dtypes = {c: t for c, t in SCHEMA.items() if c in data.columns}
+    return data.astype(dtypes)
+
+
+def parquet_columns(
+    pf: ParquetFile, spec: dict, columns: list[str] | None
+) -> tuple[list[str] | None, str | None]:
+    index_col = spec.get("index_col")
+    if isinstance(index_col, int):
+        index_col = pf.columns[index_col]
+    if columns is None:
+        return None, index_col
+    filter_columns = [f[0] for f in region_filters(spec)]
+    wanted = set(columns + filter_columns) - {index_col}
+    return [c for c in pf.columns if c in wanted and c != index_col], index_col
+
+
+def csv_kwargs(spec: dict, columns: list[str] | None) -> dict:
+    kwargs = {k: v for k, v in spec.items() if k != "format"}
+    if columns is not None and "usecols" not in kwargs:
+        # the header is parsed with the reader options of the spec (sep,
+        # comment, skiprows, names, ...), but without the column selection
+        probe = {k: v for k, v in kwargs.items() if k not in CSV_PROBE_EXCLUDED}
+        header = pd.read_csv(**probe, nrows=0).columns
+        index_col = kwargs.get("index_col")
+        if isinstance(index_col, int):
+            index_col = header[index_col]
+            kwargs["index_col"] = index_col
+        wanted = set(columns) | {index_col}
+        kwargs["usecols"] = lambda c: c in wanted
+    return kwargs
+
+
+def read_catalog(spec: dict, columns: list[str] | None = None) -> pd.DataFrame:
+    """
+    Read a catalog described by ``spec``.
+
+    CSV specs are ``pd.read_csv`` keyword arguments. Parquet specs (a path with a
+    parquet suffix, a dataset directory or ``"format": "parquet"``) take
+    ``filepath_or_buffer``, ``index_col``, ``filters``, ``region`` and ``time``.
+    Only ``columns`` (plus the index) are read if given.
+    """
+    if not is_parquet(spec):
+        return apply_schema(pd.read_csv(**csv_kwargs(spec, columns)))
+
+    pf = ParquetFile(spec["filepath_or_buffer"])
+    filters = region_filters(spec)
+    read_columns, index_col = parquet_columns(pf, spec, columns)
+    logger.debug(f"reading {read_columns} from {spec['filepath_or_buffer']}")
+    data = pf.to_pandas(columns=read_columns, filters=filters, index=index_col)
+    return apply_schema(apply_filters(data, filters))
+
+
+def iter_catalog(
+    spec: dict, chunk_size: int, columns: list[str] | None = None
+) -> Iterator[pd.DataFrame]:
+    """Read a catalog in chunks of about ``chunk_size`` rows"""
+    if not is_parquet(spec):
+        for chunk in pd.read_csv(**csv_kwargs(spec, columns), chunksize=chunk_size):
+            yield apply_schema(chunk)
+        return
+
+    pf = ParquetFile(spec["filepath_or_buffer"])
+    filters = region_filters(spec)
+    read_columns, index_col = parquet_columns(pf, spec, columns)
+    chunks, n = [], 0
+    for row_group in pf.iter_row_groups(
+        columns=read_columns, filters=filters, index=index_col
+    ):
+        chunks.append(apply_filters(row_group, filters))
+        n += len(chunks[-1])
+        if n >= chunk_size:
+            yield apply_schema(pd.concat(chunks))
+            chunks, n = [], 0
+    if len(chunks) > 0:
+        yield apply_schema(pd.concat(chunks))
+
+
+def iter_sources(
+    spec: dict, chunk_size: int, columns: list[str] | None = None
+) -> Iterator[pd.DataFrame]:
+    """
+    Read a catalog with several rows per source (index) in chunks of about
+    ``chunk_size`` rows without splitting a source. The rows of the last source
+    in a chunk are moved to the next chunk. Rows of one source have to be
+    contiguous, a ValueError is raised if a source shows up again in the same
+    or the following chunk.
+    """
+    carry, previous = None, None
+    for chunk in iter_catalog(spec, chunk_size, columns):
+        if carry is not None:
+            chunk = pd.concat([carry, chunk])
+        ids = chunk.index.to_numpy()
+        starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+        unique = pd.unique(ids[starts])
+        if len(unique) < len(starts) or (
+            previous is not None and np.isin(unique, previous).any()
+        ):
+            raise ValueError(
+                f"rows of the sources in {spec['filepath_or_buffer']} are not "
+                "contiguous, sort the catalog by its index"
+            )
+        m = ids == ids[-1]
+        carry = chunk[m]
+        if (~m).any():
+            previous = unique[:-1]
+            yield chunk[~m]
+    if carry is not None:
+        yield carry
+
+
+def write_catalog(data: pd.DataFrame, filename: str | Path, append: bool = False):
+    """Write ``data`` to parquet or CSV, depending on the suffix of ``filename``"""
+    filename = Path(filename)
+    filename.parent.mkdir(exist_ok=True, parents=True)
+    if filename.suffix in PARQUET_SUFFIXES:
+        data.to_parquet(
+            filename,
+            engine="fastparquet",
+            index=False,
+            append=append and filename.exists(),
+        )
+    else:
+        data.to_csv(
+            filename,
+            mode="a" if append else "w",
+            header=not (append and filename.exists()),
+            index=False,
+        )
+
+
+def freeze(data: pd.DataFrame) -> pd.DataFrame:
+    """Frame on read-only views of the columns of ``data``"""
+    columns = {}
+    for c in data.columns:
+        values = data[c].to_numpy()
+        values.flags.writeable = False
+        columns[c] = values
+    return pd.DataFrame(columns, index=data.index, copy=False)
+
+
+class CatalogRegistry:
+    """
+    Catalogs of the current process, keyed by their spec and the fingerprint of
+    the underlying files.
+
+    All consumers of a spec get the same frame, backed by read-only arrays. It
+    must not be modified in place, use ``DataFrame.assign`` to derive modified
+    copies. A frame is read again with the union of the columns if a consumer
+    asks for columns that were not read before.
+    """
+
+    def __init__(self):
+        self.catalogs = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    @functools.cache
+    def default(cls) -> "CatalogRegistry":
+        return cls()
+
+    @staticmethod
+    def fingerprint(spec: dict) -> str | None:
+        path = spec["filepath_or_buffer"]
+        if not isinstance(path, (str, Path)) or not Path(path).exists():
+            return None
+        return file_fingerprint(path)
+
+    def get(self, spec: dict, columns: list[str] | None = None) -> pd.DataFrame:
+        fingerprint = self.fingerprint(spec)
+        if fingerprint is None:
+            return read_catalog(spec, columns)
+        key = json.dumps(spec, sort_keys=True, default=str)
+        with self.lock:
+            known = self.catalogs.get(key)
+            if known is not None and known[0] == fingerprint:
+                read_columns = known[1]
+                if read_columns is None or (
+                    columns is not None and set(columns) <= read_columns
+                ):
+                    return known[2]
+                if columns is not None:
+                    columns = list(read_columns | set(columns))
+            logger.info(f"loading catalog {spec['filepath_or_buffer']}")
+            data = freeze(read_catalog(spec, columns))
+            # lets the caches identify the frame without hashing its contents
+            register_fingerprint(data, f"{key}-{sorted(data.columns)}-{fingerprint}")
+            self.catalogs[key] = (
+                fingerprint,
+                None if columns is None else set(columns),
+                data,
+            )
+            return data
+
+    def clear(self):
+        with self.lock:
+            self.catalogs = {}
+
+
+def load_catalog(spec: dict, columns: list[str] | None = None) -> pd.DataFrame:
+    """Shared, read-only catalog from the default registry"""
+    return CatalogRegistry.default().get(spec, columns)
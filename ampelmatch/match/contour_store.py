@@ -0,0 +1,155 @@
+import contextlib
+import fcntl
+import functools
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+import healpy as hp
+import numpy as np
+
+from ampelmatch.cache import cache_dir
+
+logger = logging.getLogger(__name__)
+
+
+class ContourStore:
+    """
+    Consolidated binary store of IceCube contour pixels.
+
+    The contour pixels of all alerts are appended to one raw int64 file that is
+    memory-mapped on read, so lookups return views without copying. A JSON
+    manifest maps the content hash of each skymap to its offset and length in
+    that file, the contour area and the llh level. It also remembers size and
+    mtime per path, so unchanged files are not hashed again.
+    """
+
+    dtype = np.dtype("<i8")
+
+    def __init__(self, directory: str | Path):
+        self.directory = Path(directory)
+        self.directory.mkdir(exist_ok=True, parents=True)
+        self.pixel_file = self.directory / "pixels.bin"
+        self.manifest_file = self.directory / "manifest.json"
+        self.lock_file = self.directory / ".lock"
+        self.manifest = self.read_manifest()
+        self._pixels = None
+
+    @classmethod
+    @functools.cache
+    def default(cls) -> "ContourStore":
+        return cls(Path(cache_dir) / "icecube_contours")
+
+    def read_manifest(self) -> dict:
+        if not self.manifest_file.exists():
+            return {"contours": {}, "files": {}}
+        return json.loads(self.manifest_file.read_text())
+
+    def write_manifest(self):
+        tmp_file = self.manifest_file.with_suffix(".tmp")
+        tmp_file.write_text(json.dumps(self.manifest))
+        tmp_file.replace(self.manifest_file)
+
+    @property
+    def pixels(self) -> np.ndarray:
+        if self._pixels is None:
+            if not self.pixel_file.exists() or self.pixel_file.stat().st_size == 0:
+                return np.array([], dtype=self.dtype)
+            self._pixels = np.memmap(self.pixel_file, dtype=self.dtype, mode="r")
+        return self._pixels
+
+    @staticmethod
+    def file_hash(filename: Path) -> str:
+        h = hashlib.sha256()
+        with filename.open("rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def content_key(self, filename: Path) -> tuple[str, bool]:
+        stat = filename.stat()
+        known = self.manifest["files"].get(str(filename))
+        if known and known["size"] == stat.st_size and known["mtime"] == stat.st_mtime:
+            return known["hash"], False
+        key = self.file_hash(filename)
+        self.manifest["files"][str(filename)] = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "hash": key,
+        }
+        return key, True
+
+    @contextlib.contextmanager
+    def locked_manifest(self):
+        with self.lock_file.open("w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # another process might have added contours in the meantime
+            manifest = self.read_manifest()
+            manifest["files"].update(self.manifest["files"])
+            manifest["contours"].update(self.manifest["contours"])
+            self.manifest = manifest
+            try:
+                yield self.manifest
+                self.write_manifest()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @staticmethod
+    def compute_contour(filename: Path) -> tuple[np.ndarray, float, float]:
+        legacy_cache_file = filename.with_suffix(".cache")
+        if legacy_cache_file.exists():
+            logger.debug(f"reading contour pixels from {legacy_cache_file}")
+            res = json.loads(legacy_cache_file.read_text())
+            return np.array(res["ctr_pix"]), res["ctr_area"], res["llh_level"]
+
+        logger.debug(f"calculating contour pixels for {filename}")
+        s, h = hp.read_map(filename, h=True)
+        h = dict(h)
+        if "Wilks theorem" in h["COMMENTS"]:
+            llh_level = 4.605170185988092
+        else:
+            llh_level = 64.2
+        ctr_pix = np.where(s < llh_level)[0]
+        ctr_area = len(ctr_pix) * hp.nside2pixarea(h["NSIDE"])
+        return ctr_pix, ctr_area, llh_level
+
+    def add(self, filename: Path, key: str):
+        ctr_pix, ctr_area, llh_level = self.compute_contour(filename)
+        with self.locked_manifest() as manifest:
+            if key not in manifest["contours"]:
+                with self.pixel_file.open("ab") as f:
+                    offset = f.tell() // self.dtype.itemsize
+                    f.write(np.asarray(ctr_pix, dtype=self.dtype).tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+                manifest["contours"][key] = {
+                    "offset": offset,
+                    "length": len(ctr_pix),
+                    "ctr_area": ctr_area,
+                    "llh_level": llh_level,
+                }
+        self._pixels = None
+        logger.debug(f"stored contour pixels of {filename} in {self.pixel_file}")
+
+    def get(self, filename: str | Path) -> tuple[np.ndarray, float, float]:
+        filename = Path(filename).resolve()
+        key, new_file = self.content_key(filename)
+        if key not in self.manifest["contours"]:
+            self.add(filename, key)
+        elif new_file:
+            with self.locked_manifest():
+                pass
+        entry = self.manifest["contours"][key]
+        stop = entry["offset"] + entry["length"]
+        if stop > len(self.pixels):
+            # other processes appended pixels since the file was mapped
+            self._pixels = None
+        if stop > len(self.pixels):
+            raise OSError(
+                f"{self.pixel_file} is shorter than its manifest, delete "
+                f"{self.directory} to rebuild it"
+            )
+        ctr_pix = self.pixels[entry["offset"] : stop]
+        return ctr_pix, entry["ctr_area"], entry["llh_level"]
@@ -1,12 +1,17 @@
 import logging
+from collections.abc import Iterator
+from functools import cached_property
+from pathlib import Path
 from typing import Annotated
 
+import numpy as np
 import pandas as pd
+from pydantic import BaseModel, Field, PositiveInt
+
 from ampelmatch.match.bayes_factor import BayesFactor
+from ampelmatch.match.catalog import iter_sources, load_catalog
+from ampelmatch.match.pair_table import PairTable
 from ampelmatch.match.prior import Prior
-from cryptography.utils import cached_property
-from pydantic import BaseModel, Field
-from tqdm import tqdm
 
 logger = logging.getLogger(__name__)
 
@@ -17,68 +22,124 @@ class StreamMatch(BaseModel):
     bayes_factor: Annotated[BayesFactor, Field(discriminator="match_type")]
     prior: Annotated[Prior, Field(discriminator="name")]
     posterior_threshold: float
+    workers: PositiveInt | None = None
 
     @cached_property
-    def posteriors(self):
+    def posteriors(self) -> PairTable:
         logger.info("Calculating probabilities")
-        primary_data = pd.read_csv(**self.primary_data)
-        match_data = [pd.read_csv(**d) for d in self.match_data]
-        bayes_factors = self.bayes_factor.evaluate(primary_data, match_data)
-        posteriors = {}
+        primary_data = self.read_primary_data()
+        match_data = self.read_match_data()
+        bayes_factors = self.bayes_factor.evaluate(
+            primary_data, match_data, workers=self.workers
+        )
         self.bayes_factor.plot_dir = self.bayes_factor.plot_dir / "posteriors"
-        for source_id, bf in tqdm(
-            bayes_factors.items(),
-            desc="Calculating posteriors",
-            total=len(bayes_factors),
-        ):
-            i_posteriors = {}
-
-            if source_id in self.bayes_factor.plot_indices:
-                fig, ax, axs = self.bayes_factor.setup_plot(
-                    primary_data.loc[source_id], len(bf)
-                )
-
-            for sd_id, sdbf in bf.items():
-                p = self.prior(primary_data.loc[source_id])
-                i_posteriors[sd_id] = (1 + (1 - p) / (p * sdbf)) ** (-1)
-
-                if source_id in self.bayes_factor.plot_indices:
-                    orig_sources = match_data[sd_id].loc[i_posteriors[sd_id].index]
-                    orig_sources.loc[:, "marker"] = "s"
-                    orig_sources.loc[:, "post"] = i_posteriors[sd_id]
-                    self.bayes_factor.add_data_to_plot(
-                        ax,
-                        orig_sources,
-                        "post",
-                        self.bayes_factor.cmaps[sd_id],
-                        f"posterior {sd_id}",
-                        axs[sd_id],
-                        cbar_lim=(0, 1),
-                    )
-
-            if source_id in self.bayes_factor.plot_indices:
-                self.bayes_factor.finalize_plot(fig, ax, source_id)
-
-            posteriors[source_id] = i_posteriors
+
+        logger.info("Calculating posteriors")
+        p = self.prior.evaluate_sources(primary_data)[bayes_factors.primary]
+        posteriors = bayes_factors.with_posterior(
+            self.posterior(p, bayes_factors.bayes_factor)
+        )
+
+        for source_id in self.bayes_factor.plot_indices:
+            self.plot_posteriors(
+                source_id, primary_data.loc[source_id], posteriors, match_data
+            )
+
         return posteriors
 
+    def read_primary_data(self) -> pd.DataFrame:
+        return load_catalog(self.primary_data, self.bayes_factor.primary_columns)
+
+    def read_match_data(self) -> list[pd.DataFrame]:
+        return [
+            load_catalog(d, self.bayes_factor.match_columns) for d in self.match_data
+        ]
+
+    def read_primary_chunks(self, chunk_size: int) -> Iterator[pd.DataFrame]:
+        """
+        Read the primary catalog in chunks of about ``chunk_size`` rows, no
+        source is split between chunks
+        """
+        return iter_sources(
+            self.primary_data, chunk_size, self.bayes_factor.primary_columns
+        )
+
+    def iter_posteriors(
+        self, chunk_size: int, output: str | Path | None = None
+    ) -> Iterator[PairTable]:
+        """
+        Match the primary catalog chunk by chunk against the indexed secondary
+        catalogs. Yields one PairTable with posteriors per chunk and, if
+        ``output`` is given, appends it to that file (parquet or CSV, depending
+        on the suffix).
+        """
+        match_data = self.read_match_data()
+        workers = self.workers or self.bayes_factor.workers
+        spatial_indices = None
+        if self.bayes_factor.disc_radius_arcsec is not None and workers == 1:
+            spatial_indices = self.bayes_factor.build_spatial_indices(match_data)
+        bayes_factor = self.bayes_factor.model_copy(
+            update={"plot": False, "plot_indices": []}
+        )
+        if output is not None:
+            output = Path(output)
+            output.unlink(missing_ok=True)
+
+        for i, chunk in enumerate(self.read_primary_chunks(chunk_size)):
+            logger.info(f"Matching chunk {i} with {len(chunk)} rows")
+            bayes_factors = bayes_factor.evaluate(
+                chunk, match_data, spatial_indices, workers=workers
+            )
+            p = self.prior.evaluate_sources(chunk)[bayes_factors.primary]
+            posteriors = bayes_factors.with_posterior(
+                self.posterior(p, bayes_factors.bayes_factor)
+            )
+            if output is not None:
+                posteriors.write(output, append=True)
+            yield posteriors
+
+    @staticmethod
+    def posterior(p: np.ndarray, bayes_factor: np.ndarray) -> np.ndarray:
+        with np.errstate(divide="ignore", over="ignore", invalid="ignore"):
+            return (1 + (1 - p) / (p * bayes_factor)) ** (-1)
+
+    def plot_posteriors(
+        self,
+        source_id,
+        i_primary_data: pd.DataFrame,
+        posteriors: PairTable,
+        match_data: list[pd.DataFrame],
+    ):
+        i_posteriors = posteriors.source(source_id, "posterior")
+        fig, ax, axs = self.bayes_factor.setup_plot(i_primary_data, len(i_posteriors))
+        for sd_id, post in i_posteriors.items():
+            orig_sources = match_data[sd_id].loc[post.index]
+            orig_sources.loc[:, "marker"] = "s"
+            orig_sources.loc[:, "post"] = post
+            self.bayes_factor.add_data_to_plot(
+                ax,
+                orig_sources,
+                "post",
+                self.bayes_factor.cmaps[sd_id],
+                f"posterior {sd_id}",
+                axs[sd_id],
+                cbar_lim=(0, 1),
+            )
+        self.bayes_factor.finalize_plot(fig, ax, source_id)
+
     def match(self) -> dict:
+        matches = self.posteriors.select(
+            self.posteriors.posterior > self.posterior_threshold
+        )
         return {
-            source_id: {
-                sd_id: post.index[post > self.posterior_threshold].tolist()
-                for sd_id, post in posts.items()
-            }
-            for source_id, posts in self.posteriors.items()
+            source_id: {sd_id: post.index.tolist() for sd_id, post in posts.items()}
+            for source_id, posts in matches.to_dict("posterior").items()
         }
 
     def n_matches(self) -> list[float]:
-        return [
-            sum([len(v[i]) for v in self.match().values()])
-            for i in range(len(self.match_data))
-        ]
+        return self.posteriors.count_per_catalog(
+            self.posteriors.posterior > self.posterior_threshold
+        ).tolist()
 
     def posterior_sum(self) -> list[float]:
-        return [
-            sum([v[i].sum() for v in self.posteriors.values()])
-            for i in range(len(self.match_data))
-        ]
+        return self.posteriors.sum_per_catalog("posterior").tolist()
@@ -0,0 +1,206 @@
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from ampelmatch.match.catalog import write_catalog
+
+logger = logging.getLogger(__name__)
+
+
+class PairTable:
+    """
+    Columnar table of (primary source, secondary catalog, secondary row) pairs.
+
+    Pairs are sorted by primary source and catalog, ``offsets`` holds the CSR
+    offsets so that the pairs of the i-th primary source are
+    ``offsets[i]:offsets[i + 1]``. ``primary`` and ``secondary`` are positional
+    indices into ``primary_ids`` and the index of the respective secondary
+    catalog.
+    """
+
+    def __init__(
+        self,
+        primary_ids: pd.Index,
+        secondary_ids: list[pd.Index],
+        primary: np.ndarray,
+        catalog: np.ndarray,
+        secondary: np.ndarray,
+        bayes_factor: np.ndarray,
+        posterior: np.ndarray | None = None,
+    ):
+        self.primary_ids = pd.Index(primary_ids)
+        self.secondary_ids = [pd.Index(s) for s in secondary_ids]
+        order = np.lexsort((catalog, primary))
+        self.primary = np.asarray(primary, dtype=np.int64)[order]
+        self.catalog = np.asarray(catalog, dtype=np.int32)[order]
+        self.secondary = np.asarray(secondary, dtype=np.int64)[order]
+        self.bayes_factor = np.asarray(bayes_factor, dtype=float)[order]
+        self.posterior = (
+            None if posterior is None else np.asarray(posterior, dtype=float)[order]
+        )
+        self.offsets = np.searchsorted(
+            self.primary, np.arange(len(self.primary_ids) + 1)
+        )
+
+    def __len__(self):
+        return len(self.primary)
+
+    @property
+    def n_catalogs(self) -> int:
+        return len(self.secondary_ids)
+
+    @classmethod
+    def from_arrays(
+        cls,
+        primary_ids: pd.Index,
+        secondary_ids: list[pd.Index],
+        pairs: list[tuple[np.ndarray, np.ndarray, np.ndarray]],
+    ) -> "PairTable":
+        """Build the table from one (primary, secondary, bayes factor) tuple per catalog"""
+        catalog = [np.full(len(p[0]), i) for i, p in enumerate(pairs)]
+        return cls(
+            primary_ids,
+            secondary_ids,
+            np.concatenate([p[0] for p in pairs] + [np.array([], dtype=int)]),
+            np.concatenate(catalog + [np.array([], dtype=int)]),
+            np.concatenate([p[1] for p in pairs] + [np.array([], dtype=int)]),
+            np.concatenate([p[2] for p in pairs] + [np.array([], dtype=float)]),
+        )
+
+    @classmethod
+    def from_dict(
+        cls,
+        bayes_factors: dict[object, dict[int, pd.Series]],
+        secondary_ids: list[pd.Index],
+        by_position: bool = False,
+    ) -> "PairTable":
+        """
+        Build the table from the nested ``{primary_id: {catalog: pd.Series}}``
+        view. The series are indexed by the labels in ``secondary_ids``, or by
+        row positions if ``by_position`` is set.
+        """
+        primary_ids = pd.Index(list(bayes_factors.keys()))
+        pairs = []
+        for imd, index in enumerate(secondary_ids):
+            series = [
+                (i, bf[imd]) for i, bf in enumerate(bayes_factors.values()) if imd in bf
+            ]
+            pairs.append(
+                (
+                    np.repeat(
+                        np.array([i for i, _ in series], dtype=int),
+                        [len(s) for _, s in series],
+                    ),
+                    np.concatenate(
+                        [
+                            (
+                                s.index.to_numpy(dtype=int)
+                                if by_position
+                                else index.get_indexer(s.index)
+                            )
+                            for _, s in series
+                        ]
+                        + [np.array([], dtype=int)]
+                    ),
+                    np.concatenate(
+                        [s.to_numpy(dtype=float) for _, s in series]
+                        + [np.array([], dtype=float)]
+                    ),
+                )
+            )
+        return cls.from_arrays(primary_ids, secondary_ids, pairs)
+
+    def with_posterior(self, posterior: np.ndarray) -> "PairTable":
+        table = PairTable.__new__(PairTable)
+        table.__dict__.update(self.__dict__)
+        table.posterior = np.asarray(posterior, dtype=float)
+        return table
+
+    def select(self, mask: np.ndarray) -> "PairTable":
+        return PairTable(
+            self.primary_ids,
+            self.secondary_ids,
+            self.primary[mask],
+            self.catalog[mask],
+            self.secondary[mask],
+            self.bayes_factor[mask],
+            None if self.posterior is None else self.posterior[mask],
+        )
+
+    def column(self, column: str) -> np.ndarray:
+        values = getattr(self, column)
+        if values is None:
+            raise ValueError(f"{column} is not set")
+        return values
+
+    def source(self, primary_id, column: str = "bayes_factor") -> dict[int, pd.Series]:
+        """``{catalog: pd.Series}`` view of a single primary source"""
+        i = self.primary_ids.get_loc(primary_id)
+        s = slice(self.offsets[i], self.offsets[i + 1])
+        return self._catalog_series(
+            self.catalog[s], self.secondary[s], self.column(column)[s]
+        )
+
+    def _catalog_series(self, catalog, secondary, values) -> dict[int, pd.Series]:
+        bounds = np.searchsorted(catalog, np.arange(self.n_catalogs + 1))
+        return {
+            imd: pd.Series(
+                values[bounds[imd] : bounds[imd + 1]],
+                index=index[secondary[bounds[imd] : bounds[imd + 1]]],
+            )
+            for imd, index in enumerate(self.secondary_ids)
+        }
+
+    def to_dict(
+        self, column: str = "bayes_factor"
+    ) -> dict[object, dict[int, pd.Series]]:
+        """Rebuild the nested ``{primary_id: {catalog: pd.Series}}`` view"""
+        values = self.column(column)
+        return {
+            primary_id: self._catalog_series(
+                self.catalog[self.offsets[i] : self.offsets[i + 1]],
+                self.secondary[self.offsets[i] : self.offsets[i + 1]],
+                values[self.offsets[i] : self.offsets[i + 1]],
+            )
+            for i, primary_id in enumerate(self.primary_ids)
+        }
+
+    def to_frame(self) -> pd.DataFrame:
+        # concatenating keeps the index dtype if all catalogs share it
+        secondary_ids = [
+            pd.Series(
+                index[self.secondary[self.catalog == imd]],
+                index=np.flatnonzero(self.catalog == imd),
+            )
+            for imd, index in enumerate(self.secondary_ids)
+        ]
+        data = {
+            "primary_id": self.primary_ids[self.primary],
+            "catalog": self.catalog,
+            "secondary_id": (
+                pd.concat(secondary_ids).sort_index().to_numpy()
+                if len(secondary_ids) > 0
+                else np.array([], dtype=np.int64)
+            ),
+            "bayes_factor": self.bayes_factor,
+        }
+        if self.posterior is not None:
+            data["posterior"] = self.posterior
+        return pd.DataFrame(data)
+
+    def write(self, filename: str | Path, append: bool = False):
+        """Write the pairs to parquet or CSV, depending on the suffix of ``filename``"""
+        logger.info(f"writing {len(self)} pairs to {filename}")
+        write_catalog(self.to_frame(), filename, append=append)
+
+    def count_per_catalog(self, mask: np.ndarray) -> np.ndarray:
+        return np.bincount(self.catalog[mask], minlength=self.n_catalogs)
+
+    def sum_per_catalog(self, column: str = "posterior") -> np.ndarray:
+        values = self.column(column)
+        m = ~np.isnan(values)
+        return np.bincount(
+            self.catalog[m], weights=values[m], minlength=self.n_catalogs
+        )
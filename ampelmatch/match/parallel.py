@@ -0,0 +1,207 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+import healpy as hp
+import numpy as np
+import pandas as pd
+
+from ampelmatch.match.pair_table import PairTable
+from ampelmatch.match.spatial_index import HealpixIndex
+
+logger = logging.getLogger(__name__)
+
+INDEX_COLUMN = "__index__"
+
+# state shared by all tasks of a worker process, see init_worker
+worker_state = {}
+
+
+class SharedFrame:
+    """
+    DataFrame whose numeric columns (and index) live in shared memory.
+
+    Pickling a SharedFrame only transfers the names of the shared memory blocks,
+    workers attach to them and copy out the rows they need. Non-numeric columns
+    are pickled along, so SharedFrames should be sent to each worker only once,
+    with init_worker.
+    """
+
+    def __init__(self, data: pd.DataFrame, share_index: bool = True):
+        self.columns = list(data.columns)
+        self.n_rows = len(data)
+        self.blocks = {}
+        self.objects = {}
+        self._shm = []
+        columns = {c: data[c].to_numpy() for c in data.columns}
+        if share_index:
+            columns[INDEX_COLUMN] = data.index.to_numpy()
+            self.index_name = data.index.name
+        for c, values in columns.items():
+            if values.dtype.kind not in "biuf":
+                self.objects[c] = values
+                continue
+            shm = SharedMemory(create=True, size=max(values.nbytes, 1))
+            np.ndarray(values.shape, dtype=values.dtype, buffer=shm.buf)[:] = values
+            self.blocks[c] = (shm.name, values.dtype.str, values.shape)
+            self._shm.append(shm)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_shm"] = []
+        return state
+
+    def take(self, rows: np.ndarray) -> pd.DataFrame:
+        data = {}
+        for c in self.columns + [INDEX_COLUMN]:
+            if c in self.blocks:
+                name, dtype, shape = self.blocks[c]
+                shm = SharedMemory(name=name)
+                data[c] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)[rows].copy()
+                shm.close()
+            elif c in self.objects:
+                data[c] = self.objects[c][rows]
+        df = pd.DataFrame(data)
+        if INDEX_COLUMN in df:
+            df = df.set_index(INDEX_COLUMN)
+            df.index.name = self.index_name
+        return df
+
+    def unlink(self):
+        for shm in self._shm:
+            shm.close()
+            shm.unlink()
+        self._shm = []
+
+
+def init_worker(state: dict):
+    """Pool initializer, keeps ``state`` for all tasks of the worker"""
+    worker_state.clear()
+    worker_state.update(state)
+
+
+def halo_nside(halo_arcsec: float) -> int:
+    """Finest HEALPix nside whose neighbouring pixels still cover the halo"""
+    nside = 1024
+    while nside > 1 and halo_arcsec / 60 > 0.5 * hp.nside2resol(nside, arcmin=True):
+        nside //= 2
+    return nside
+
+
+def shard_nside(ra: np.ndarray, dec: np.ndarray, max_nside: int, workers: int) -> int:
+    """Finest HEALPix nside that still gives only a few shards per worker"""
+    nside = max_nside
+    while nside > 1:
+        n_shards = len(np.unique(hp.ang2pix(nside, ra, dec, nest=True, lonlat=True)))
+        if n_shards <= 4 * workers:
+            break
+        nside //= 2
+    return nside
+
+
+def halo_pixels(shard: int, shard_nside: int, halo_nside: int) -> np.ndarray:
+    """NESTED pixels at ``halo_nside`` covering a shard pixel and its halo"""
+    n_children = (halo_nside // shard_nside) ** 2
+    children = np.arange(shard * n_children, (shard + 1) * n_children)
+    neighbours = hp.get_all_neighbours(halo_nside, children, nest=True)
+    return np.unique(np.append(neighbours.flatten(), children))
+
+
+def _evaluate_shard(primary_rows: np.ndarray, match_rows: list[np.ndarray]):
+    i_primary_data = worker_state["primary_data"].take(primary_rows)
+    i_match_data = [m.take(r) for m, r in zip(worker_state["match_data"], match_rows)]
+    table = worker_state["bayes_factor"].evaluate(i_primary_data, i_match_data)
+    secondary = np.empty(len(table), dtype=np.int64)
+    for imd, rows in enumerate(match_rows):
+        m = table.catalog == imd
+        secondary[m] = rows[table.secondary[m]]
+    return (
+        table.primary_ids,
+        table.primary,
+        table.catalog,
+        secondary,
+        table.bayes_factor,
+    )
+
+
+def evaluate_sharded(
+    bayes_factor,
+    primary_data: pd.DataFrame,
+    match_data: list[pd.DataFrame],
+    workers: int,
+) -> PairTable:
+    """
+    Evaluate ``bayes_factor`` in a process pool, with the sky split into coarse
+    HEALPix shards. Each shard gets its primary sources and the secondary
+    sources within a halo around it.
+    """
+    primary_sources = bayes_factor.primary_source_positions(primary_data)
+    ra = primary_sources["ra"].to_numpy()
+    dec = primary_sources["dec"].to_numpy()
+    halo_arcsec = bayes_factor.halo_arcsec()
+    max_nside = 1024 if halo_arcsec is None else halo_nside(halo_arcsec)
+    nside = shard_nside(ra, dec, max_nside, workers)
+    # a shard is covered by at most 32 x 32 halo pixels, so the halo adds at
+    # most 1/32 of the shard width on each side
+    h_nside = min(max_nside, 32 * nside)
+    source_shards = hp.ang2pix(nside, ra, dec, nest=True, lonlat=True)
+    shards = np.unique(source_shards)
+    logger.info(
+        f"evaluating {len(shards)} shards at nside {nside} on {workers} workers"
+    )
+
+    row_shards = source_shards[primary_sources.index.get_indexer(primary_data.index)]
+    row_order = np.argsort(row_shards, kind="stable")
+    row_bounds = np.searchsorted(row_shards[row_order], shards, side="left")
+    row_bounds = np.append(row_bounds, len(row_order))
+
+    if halo_arcsec is not None:
+        halo_indices = [HealpixIndex(md, h_nside) for md in match_data]
+
+    worker_bayes_factor = bayes_factor.model_copy(
+        update={"workers": 1, "plot": False, "plot_indices": []}
+    )
+    shared_primary = SharedFrame(primary_data)
+    shared_match = [SharedFrame(md, share_index=False) for md in match_data]
+    state = {
+        "bayes_factor": worker_bayes_factor,
+        "primary_data": shared_primary,
+        "match_data": shared_match,
+    }
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=init_worker, initargs=(state,)
+        ) as executor:
+            futures = []
+            for i, shard in enumerate(shards):
+                if halo_arcsec is None:
+                    match_rows = [np.arange(len(md)) for md in match_data]
+                else:
+                    pixels = halo_pixels(shard, nside, h_nside)
+                    match_rows = [
+                        np.sort(index.query(pixels)) for index in halo_indices
+                    ]
+                futures.append(
+                    executor.submit(
+                        _evaluate_shard,
+                        np.sort(row_order[row_bounds[i] : row_bounds[i + 1]]),
+                        match_rows,
+                    )
+                )
+            results = [f.result() for f in futures]
+    finally:
+        shared_primary.unlink()
+        for m in shared_match:
+            m.unlink()
+
+    primary_positions = [
+        primary_sources.index.get_indexer(ids)[primary] for ids, primary, *_ in results
+    ]
+    return PairTable(
+        primary_sources.index,
+        [md.index for md in match_data],
+        np.concatenate(primary_positions + [np.array([], dtype=int)]),
+        np.concatenate([r[2] for r in results] + [np.array([], dtype=int)]),
+        np.concatenate([r[3] for r in results] + [np.array([], dtype=int)]),
+        np.concatenate([r[4] for r in results] + [np.array([], dtype=float)]),
+    )
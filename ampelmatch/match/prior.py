@@ -1,14 +1,17 @@
 import abc
 import logging
+from concurrent.futures import ProcessPoolExecutor
 from functools import cached_property
 from typing import Literal, Union, Annotated
 
 import healpy as hp
 import numpy as np
 import pandas as pd
-from ampelmatch.cache import cache_dir, compute_density_hash
+from ampelmatch.cache import TieredCache, cached, compute_density_hash
 from ampelmatch.match.bayes_factor import BayesFactor
-from cachier import cachier
+from ampelmatch.match.catalog import iter_catalog, iter_sources, load_catalog
+from ampelmatch.match.pair_table import PairTable
+from ampelmatch.match.parallel import SharedFrame, init_worker, worker_state
 from pydantic import (
     BaseModel,
     field_validator,
@@ -27,18 +30,78 @@ class BasePrior(BaseModel, abc.ABC):
     model_config = ConfigDict(arbitrary_types_allowed=True)
 
     @abc.abstractmethod
-    def evaluate(self, data: pd.DataFrame) -> float: ...
+    def evaluate_many(self, ra: np.ndarray, dec: np.ndarray) -> np.ndarray:
+        """Prior at the positions ``ra``, ``dec`` (in degrees)"""
+
+    def evaluate(self, data: pd.DataFrame) -> float:
+        return self.evaluate_many(
+            np.array([data.ra.median()]), np.array([data.dec.median()])
+        )[0]
 
     def __call__(self, data: pd.DataFrame) -> float:
         return self.evaluate(data)
 
+    def evaluate_sources(self, data: pd.DataFrame) -> np.ndarray:
+        """Prior of every source in ``data``, in the order of ``data.index.unique()``"""
+        positions = data[["ra", "dec"]].groupby(level=0, sort=False).median()
+        return self.evaluate_many(
+            positions["ra"].to_numpy(), positions["dec"].to_numpy()
+        )
+
+
+class DensityPrior(BasePrior):
+    """Prior from the source densities of the primary and the match catalogs"""
 
-class SurfaceDensityPrior(BasePrior, frozen=True):
-    name: Literal["surface_density"]
     primary_data: dict
     match_data: list[dict]
+    chunk_size: PositiveInt = 1_000_000
+
+    @computed_field
+    @cached_property
+    def primary_data_df(self) -> pd.DataFrame:
+        return load_catalog(self.primary_data, ["ra", "dec"])
+
+    @computed_field
+    @cached_property
+    def match_data_df(self) -> list[pd.DataFrame]:
+        return [load_catalog(d, ["ra", "dec"]) for d in self.match_data]
+
+    def pixel_counts(self, nside: int, nest: bool = False) -> list[pd.Series]:
+        """
+        Number of sources per occupied HEALPix pixel for the primary and every
+        match catalog. The catalogs are read in chunks of ``chunk_size`` rows
+        and only the counts are kept, sources of the primary catalog are placed
+        at the median position of their rows.
+        """
+        counts = []
+        for i, spec in enumerate([self.primary_data] + self.match_data):
+            if i == 0:
+                chunks = (
+                    c[["ra", "dec"]].groupby(level=0, sort=False).median()
+                    for c in iter_sources(spec, self.chunk_size, ["ra", "dec"])
+                )
+            else:
+                chunks = iter_catalog(spec, self.chunk_size, ["ra", "dec"])
+            total = pd.Series(dtype="int64")
+            for chunk in chunks:
+                pixels = hp.ang2pix(
+                    nside,
+                    theta=chunk.ra.to_numpy(),
+                    phi=chunk.dec.to_numpy(),
+                    nest=nest,
+                    lonlat=True,
+                )
+                occupied, n = np.unique(pixels, return_counts=True)
+                total = total.add(pd.Series(n, index=occupied), fill_value=0)
+            counts.append(total.astype("int64").rename(i))
+        return counts
+
+
+class SurfaceDensityPrior(DensityPrior, frozen=True):
+    name: Literal["surface_density"]
     nside: PositiveInt
     area_sqdg: float
+    interpolate: bool = False
     cache: dict = {}
 
     @field_validator("nside")
@@ -49,56 +112,192 @@ class SurfaceDensityPrior(BasePrior, frozen=True):
 
     @computed_field
     @cached_property
-    def primary_data_df(self) -> pd.DataFrame:
-        return pd.read_csv(**self.primary_data)
+    def densities(self) -> pd.Series:
+        return self.compute_densities(self.pixel_counts(self.nside), self.nside)
+
+    @staticmethod
+    @cached(hash_func=compute_density_hash)
+    def compute_densities(data: list[pd.Series], nside) -> pd.Series:
+        """
+        Prior per HEALPix pixel (RING ordering) from the number of sources per
+        pixel of every catalog, the primary catalog first. Only pixels that hold
+        sources of every catalog get a prior, all other pixels have no finite
+        prior.
+        """
+        logger.info("computing prior")
+        pix_area = hp.nside2pixarea(nside)
+        table = pd.concat(data, axis=1).fillna(0)
+        counts = table.to_numpy().T
+        median_densities = [np.median(ci[ci > 0]) / pix_area for ci in counts]
+        logger.info(f"median density per sr {median_densities}")
+        max_data_length = np.argmax([d.sum() for d in data])
+        logger.debug(f"max data length {max_data_length}")
+        m = (counts > 0).all(axis=0)
+        densities = counts[:, m] / pix_area
+        p = densities[max_data_length] / (
+            densities.prod(axis=0) * (4 * np.pi) ** (len(data) - 1)
+        )
+        p = pd.Series(p, index=table.index.to_numpy()[m])
+        logger.info(f"median prior {p.median()} in {m.sum()} pixels")
+        return p
+
+    def lookup(self, pixels: np.ndarray) -> np.ndarray:
+        """Prior of ``pixels``, nan where not all catalogs have sources"""
+        return self.densities.reindex(pixels.ravel()).to_numpy().reshape(pixels.shape)
+
+    def evaluate_many(self, ra: np.ndarray, dec: np.ndarray) -> np.ndarray:
+        """Prior at the positions ``ra``, ``dec`` (in degrees)"""
+        data_hp_index = hp.ang2pix(nside=self.nside, theta=ra, phi=dec, lonlat=True)
+        nearest = self.lookup(data_hp_index)
+        if not self.interpolate:
+            return nearest
+        # bilinear interpolation between the four nearest pixels, pixels without
+        # a finite prior (not covered by all catalogs) are left out
+        pixels, weights = hp.get_interp_weights(
+            self.nside, theta=ra, phi=dec, lonlat=True
+        )
+        values = self.lookup(pixels)
+        m = np.isfinite(values)
+        weights = np.where(m, weights, 0)
+        weighted = (weights * np.where(m, values, 0)).sum(axis=0)
+        with np.errstate(invalid="ignore"):
+            interpolated = weighted / weights.sum(axis=0)
+        return np.where(m.any(axis=0), interpolated, nearest)
 
-    @computed_field
-    @cached_property
-    def match_data_df(self) -> list[pd.DataFrame]:
-        return [pd.read_csv(**d) for d in self.match_data]
+
+class MultiOrderDensityPrior(DensityPrior, frozen=True):
+    """
+    Surface density prior on an adaptive multi-order HEALPix map.
+
+    Starting from order 0, a pixel is split into its four children if at least
+    one child has ``min_count`` sources of every catalog and ``max_order`` is
+    not reached. Those children get their own density and are split further,
+    the other children keep the density of the parent. The prior is stored per
+    leaf pixel in NUNIQ numbering (``4 * 4**order + ipix``, NESTED). Order 0
+    pixels without sources of every catalog have no prior.
+    """
+
+    name: Literal["multi_order_density"]
+    max_order: int
+    min_count: PositiveInt = 10
+
+    @field_validator("max_order")
+    def check_max_order(cls, v):
+        if not 0 <= v <= 29:
+            raise ValueError(f"max_order {v} is not valid")
+        return v
 
     @computed_field
     @cached_property
-    def densities(self) -> pd.DataFrame:
+    def densities(self) -> pd.Series:
         return self.compute_densities(
-            [self.primary_data_df] + self.match_data_df, self.nside
+            self.pixel_counts(2**self.max_order, nest=True),
+            self.max_order,
+            self.min_count,
         )
 
     @staticmethod
-    @cachier(cache_dir=cache_dir, hash_func=compute_density_hash)
-    def compute_densities(data: tuple[pd.DataFrame], nside) -> pd.DataFrame:
-        logger.info("computing prior")
-        densities = pd.DataFrame(
-            index=range(hp.nside2npix(nside)),
-            dtype=float,
-            columns=range(len(data)),
-        )
-        # assume that the first data entry is the primary data and group by source index
-        c = ["ra", "dec"]
-        pix_area = hp.nside2pixarea(nside)
-        data[0] = data[0][c].groupby(level=0).median()
-        for i, i_data in enumerate(data):
-            ids_list = hp.ang2pix(
-                nside=nside, theta=i_data.ra, phi=i_data.dec, lonlat=True
+    @cached(hash_func=compute_density_hash)
+    def compute_densities(
+        data: list[pd.Series], max_order: int, min_count: int
+    ) -> pd.Series:
+        """
+        Prior per leaf pixel from the number of sources per ``max_order`` pixel
+        (NESTED) of every catalog, the primary catalog first
+        """
+        logger.info("computing multi-order prior")
+        catalog = np.repeat(np.arange(len(data)), [len(d) for d in data])
+        pixels = np.concatenate([d.index.to_numpy(dtype="int64") for d in data])
+        weights = np.concatenate([d.to_numpy(dtype=float) for d in data])
+        max_data_length = np.argmax([d.sum() for d in data])
+
+        def count(order: int, active: np.ndarray) -> tuple[np.ndarray, ...]:
+            ids = pixels[active] >> (2 * (max_order - order))
+            occupied, inverse = np.unique(ids, return_inverse=True)
+            counts = np.bincount(
+                catalog[active] * len(occupied) + inverse,
+                weights=weights[active],
+                minlength=len(data) * len(occupied),
+            ).reshape(len(data), len(occupied))
+            return occupied, inverse, counts
+
+        def prior(counts: np.ndarray, order: int) -> np.ndarray:
+            densities = counts / hp.nside2pixarea(2**order)
+            return densities[max_data_length] / (
+                densities.prod(axis=0) * (4 * np.pi) ** (len(data) - 1)
             )
-            ids, count = np.unique(ids_list, return_counts=True)
-            densities.loc[ids, i] = count / pix_area
-        logger.info(f"median density per sr \n{densities.median().to_string()}")
-        max_data_length = np.argmax([len(d) for d in data])
-        logger.debug(f"max data length {max_data_length}")
-        densities.fillna(0, inplace=True)
-        p = densities[densities.columns[max_data_length]] / (
-            densities.product(axis=1, skipna=False) * (4 * np.pi) ** (len(data) - 1)
-        )
-        logger.info(f"median prior {p.median()}")
+
+        uniq, priors = [], []
+        active = np.ones(len(pixels), dtype=bool)
+        for order in range(max_order + 1):
+            occupied, _, counts = count(order, active)
+            valid = (counts > 0).all(axis=0)
+            refine = np.zeros(len(occupied), dtype=bool)
+            if order < max_order:
+                # every child with enough sources of all catalogs gets its own
+                # density, the other children keep the density of the parent
+                children, child_inverse, child_counts = count(order + 1, active)
+                full = child_counts.min(axis=0) >= min_count
+                parent = np.searchsorted(occupied, children >> 2)
+                refine = np.bincount(parent, full, len(occupied)) > 0
+
+                all_children = (occupied[refine, None] << 2) + np.arange(4)
+                inherits = ~np.isin(all_children, children[full])
+                inherited = np.broadcast_to(
+                    prior(counts[:, refine], order)[:, None], all_children.shape
+                )
+                uniq.append(4 * 4 ** (order + 1) + all_children[inherits])
+                priors.append(inherited[inherits])
+
+            leaves = ~refine & valid
+            uniq.append(4 * 4**order + occupied[leaves])
+            priors.append(prior(counts[:, leaves], order))
+            if order == max_order:
+                break
+            active[active] = full[child_inverse]
+            if not active.any():
+                break
+
+        p = pd.Series(np.concatenate(priors), index=np.concatenate(uniq))
+        logger.info(f"median prior {p.median()} in {len(p)} pixels")
         return p
 
-    def evaluate(self, data: pd.DataFrame) -> float:
-        ra = data.ra.median()
-        dec = data.dec.median()
-        data_hp_index = hp.ang2pix(nside=self.nside, theta=ra, phi=dec, lonlat=True)
-        # TODO: decide whether to use interpolation here
-        return self.densities.loc[data_hp_index]
+    @cached_property
+    def leaf_ranges(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Sorted start and end pixels of the leaves at ``max_order`` and their priors"""
+        uniq = self.densities.index.to_numpy()
+        order = np.zeros(len(uniq), dtype=int)
+        for o in range(1, self.max_order + 1):
+            order[uniq >= 4 * 4**o] = o
+        shift = 2 * (self.max_order - order)
+        start = (uniq - 4 * 4**order) << shift
+        end = start + (1 << shift)
+        s = np.argsort(start)
+        return start[s], end[s], self.densities.to_numpy()[s]
+
+    def evaluate_many(self, ra: np.ndarray, dec: np.ndarray) -> np.ndarray:
+        """Prior at the positions ``ra``, ``dec`` (in degrees), nan outside of all leaves"""
+        start, end, priors = self.leaf_ranges
+        pixels = hp.ang2pix(2**self.max_order, ra, dec, nest=True, lonlat=True)
+        if len(start) == 0:
+            return np.full(len(pixels), np.nan)
+        i = np.searchsorted(start, pixels, side="right") - 1
+        inside = (i >= 0) & (pixels < end[np.maximum(i, 0)])
+        return np.where(inside, priors[np.maximum(i, 0)], np.nan)
+
+
+def _realize_scramble(seed: np.random.SeedSequence) -> PairTable:
+    # the frames are copied out of shared memory once per worker
+    if "frames" not in worker_state:
+        primary_data = worker_state["primary_data"]
+        worker_state["frames"] = (
+            primary_data.take(np.arange(primary_data.n_rows)),
+            [m.take(np.arange(m.n_rows)) for m in worker_state["match_data"]],
+        )
+    primary_data, match_data = worker_state["frames"]
+    return worker_state["prior"].realize_scramble(
+        np.random.default_rng(seed), primary_data, match_data
+    )
 
 
 class RAScramblePrior(BasePrior, frozen=True):
@@ -107,27 +306,278 @@ class RAScramblePrior(BasePrior, frozen=True):
     match_data: list[dict]
     bayes_factor: Annotated[BayesFactor, Field(discriminator="match_type")]
     n_scrambles: PositiveInt
+    seed: int | None = None
+    workers: PositiveInt = 1
+    n_dec_bands: PositiveInt = 18
+    bayes_factor_threshold: float = 1.0
+    bayes_factor_quantiles: list[float] = [0.5, 0.9, 0.99]
+    statistic: Literal["max", "sum"] = "max"
+    target_precision: float = 0.1
+    batch_size: PositiveInt = 50
+    max_scrambles: PositiveInt = 10_000
 
-    def realize_scramble(self):
+    @staticmethod
+    def scramble(
+        match_data: list[pd.DataFrame], rng: np.random.Generator
+    ) -> list[pd.DataFrame]:
         scrambled_match_data = []
-        for d in self.match_data:
-            d = pd.read_csv(**d)
-            d["ra"] = d["ra"].sample(frac=1).values
-            scrambled_match_data.append(d)
-        primary_data = pd.read_csv(**self.primary_data)
-        bayes_factors = self.bayes_factor.evaluate(primary_data, scrambled_match_data)
-        return bayes_factors
-
-    def scrambled_bayes_factors(self):
-        return [
-            self.realize_scramble()
-            for _ in tqdm(
-                range(self.n_scrambles), desc="Scrambling", total=self.n_scrambles
+        for d in match_data:
+            ra = d["ra"].to_numpy()
+            scrambled_ra = ra[rng.permutation(len(d))]
+            # the catalog is shared, the scrambled ra goes into a new frame. Contours
+            # do not move with ra, they are shifted by ra_offset instead
+            scrambled_match_data.append(
+                d.assign(ra=scrambled_ra, ra_offset=scrambled_ra - ra)
+            )
+        return scrambled_match_data
+
+    def realize_scramble(
+        self,
+        rng: np.random.Generator | None = None,
+        primary_data: pd.DataFrame | None = None,
+        match_data: list[pd.DataFrame] | None = None,
+    ) -> PairTable:
+        if rng is None:
+            rng = np.random.default_rng()
+        if primary_data is None:
+            primary_data = load_catalog(
+                self.primary_data, self.bayes_factor.primary_columns
             )
+        if match_data is None:
+            match_data = [
+                load_catalog(d, self.bayes_factor.match_columns)
+                for d in self.match_data
+            ]
+        return self.bayes_factor.evaluate(primary_data, self.scramble(match_data, rng))
+
+    def scrambled_bayes_factors(self) -> list[PairTable]:
+        """
+        Bayes factors of ``n_scrambles`` RA scrambles. Every scramble draws from
+        its own stream spawned from ``seed``, so the result does not depend on
+        the number of workers.
+        """
+        seeds = np.random.SeedSequence(self.seed).spawn(self.n_scrambles)
+        primary_data = load_catalog(
+            self.primary_data, self.bayes_factor.primary_columns
+        )
+        match_data = [
+            load_catalog(d, self.bayes_factor.match_columns) for d in self.match_data
         ]
+        return self.run_scrambles(seeds, primary_data, match_data)
 
-    def evaluate(self, data: pd.DataFrame) -> float:
-        pass
+    def run_scrambles(
+        self,
+        seeds: list[np.random.SeedSequence],
+        primary_data: pd.DataFrame,
+        match_data: list[pd.DataFrame],
+    ) -> list[PairTable]:
+        if self.workers == 1:
+            return [
+                self.realize_scramble(
+                    np.random.default_rng(seed), primary_data, match_data
+                )
+                for seed in tqdm(seeds, desc="Scrambling", total=len(seeds))
+            ]
+
+        worker_prior = self.model_copy(
+            update={
+                "bayes_factor": self.bayes_factor.model_copy(
+                    update={"workers": 1, "plot": False, "plot_indices": []}
+                )
+            }
+        )
+        shared_primary = SharedFrame(primary_data)
+        shared_match = [SharedFrame(md) for md in match_data]
+        # the prior and the frames go to every worker once, tasks only get a seed
+        state = {
+            "prior": worker_prior,
+            "primary_data": shared_primary,
+            "match_data": shared_match,
+        }
+        try:
+            with ProcessPoolExecutor(
+                max_workers=self.workers, initializer=init_worker, initargs=(state,)
+            ) as executor:
+                futures = [executor.submit(_realize_scramble, seed) for seed in seeds]
+                return [
+                    f.result()
+                    for f in tqdm(futures, desc="Scrambling", total=len(seeds))
+                ]
+        finally:
+            shared_primary.unlink()
+            for m in shared_match:
+                m.unlink()
+
+    def source_statistic(self, table: PairTable) -> np.ndarray:
+        """Test statistic per primary source of ``table``, in the order of ``primary_ids``"""
+        if self.statistic == "sum":
+            return np.bincount(
+                table.primary,
+                weights=table.bayes_factor,
+                minlength=len(table.primary_ids),
+            )
+        statistic = np.zeros(len(table.primary_ids))
+        np.maximum.at(statistic, table.primary, table.bayes_factor)
+        return statistic
+
+    def tail_probabilities(self, observed: PairTable | None = None) -> pd.DataFrame:
+        """
+        Probability to get a statistic at least as large as the observed one
+        by chance, per primary source. Scrambles are drawn in batches of
+        ``batch_size``, a source drops out once the relative error of its tail
+        probability is below ``target_precision``. Only sources that are still
+        active are evaluated, until ``max_scrambles`` are used up.
+        """
+        primary_data = load_catalog(
+            self.primary_data, self.bayes_factor.primary_columns
+        )
+        match_data = [
+            load_catalog(d, self.bayes_factor.match_columns) for d in self.match_data
+        ]
+        if observed is None:
+            observed = self.bayes_factor.evaluate(primary_data, match_data)
+        observed_statistic = self.source_statistic(observed)
+        n_exceed = np.zeros(len(observed.primary_ids), dtype=int)
+        n_trials = np.zeros(len(observed.primary_ids), dtype=int)
+        relative_error = np.full(len(observed.primary_ids), np.inf)
+        active = np.ones(len(observed.primary_ids), dtype=bool)
+        seed_sequence = np.random.SeedSequence(self.seed)
+
+        while active.any() and n_trials.max() < self.max_scrambles:
+            n = min(self.batch_size, self.max_scrambles - n_trials.max())
+            active_ids = observed.primary_ids[active]
+            logger.info(f"scrambling {len(active_ids)} active sources {n} times")
+            tables = self.run_scrambles(
+                seed_sequence.spawn(n),
+                primary_data[primary_data.index.isin(active_ids)],
+                match_data,
+            )
+            for table in tables:
+                statistic = np.zeros(len(active_ids))
+                statistic[active_ids.get_indexer(table.primary_ids)] = (
+                    self.source_statistic(table)
+                )
+                n_exceed[active] += statistic >= observed_statistic[active]
+            n_trials[active] += n
+
+            p = (n_exceed + 1) / (n_trials + 1)
+            relative_error = np.sqrt((1 - p) / ((n_trials + 1) * p))
+            active &= relative_error > self.target_precision
+
+        logger.info(
+            f"{(~active).sum()} of {len(active)} sources reached a relative precision "
+            f"of {self.target_precision}, median {np.median(relative_error):.3f}, "
+            f"worst {relative_error.max():.3f} after {n_trials.sum()} source scrambles"
+        )
+        return pd.DataFrame(
+            {
+                "statistic": observed_statistic,
+                "n_scrambles": n_trials,
+                "n_exceed": n_exceed,
+                "p_value": (n_exceed + 1) / (n_trials + 1),
+                "relative_error": relative_error,
+                "converged": relative_error <= self.target_precision,
+            },
+            index=observed.primary_ids,
+        )
+
+    @property
+    def dec_band_edges(self) -> np.ndarray:
+        # bands of equal area
+        return np.degrees(np.arcsin(np.linspace(-1, 1, self.n_dec_bands + 1)))
+
+    def dec_band(self, dec: np.ndarray) -> np.ndarray:
+        i = np.searchsorted(self.dec_band_edges, dec, side="right") - 1
+        return np.clip(i, 0, self.n_dec_bands - 1)
+
+    def compute_prior_table(self) -> pd.DataFrame:
+        """
+        Empirical prior per dec band from the scrambles. ``n_chance`` is the mean
+        number of candidates per primary source with a Bayes factor of at least
+        ``bayes_factor_threshold``, the prior is ``1 / (1 + n_chance)``. Bands
+        without primary sources get the mean ``n_chance`` of all bands. The
+        quantiles of the scrambled Bayes factors are kept alongside.
+        """
+        logger.info("computing scramble prior table")
+        primary_sources = self.bayes_factor.primary_source_positions(
+            load_catalog(self.primary_data, self.bayes_factor.primary_columns)
+        )
+        source_bands = self.dec_band(primary_sources["dec"].to_numpy())
+        n_primary = np.bincount(source_bands, minlength=self.n_dec_bands)
+        n_chance = np.zeros(self.n_dec_bands)
+        pair_bands, bayes_factors = [], []
+        for table in self.scrambled_bayes_factors():
+            bands = source_bands[
+                primary_sources.index.get_indexer(table.primary_ids)[table.primary]
+            ]
+            m = table.bayes_factor >= self.bayes_factor_threshold
+            n_chance += np.bincount(bands[m], minlength=self.n_dec_bands)
+            pair_bands.append(bands)
+            bayes_factors.append(table.bayes_factor)
+        pair_bands = np.concatenate(pair_bands)
+        bayes_factors = np.concatenate(bayes_factors)
+
+        # bands without primary sources fall back to the mean over all bands
+        overall = n_chance.sum() / (self.n_scrambles * max(n_primary.sum(), 1))
+        n_chance = np.divide(
+            n_chance,
+            self.n_scrambles * n_primary,
+            out=np.full(self.n_dec_bands, overall),
+            where=n_primary > 0,
+        )
+        edges = self.dec_band_edges
+        prior_table = pd.DataFrame(
+            {
+                "dec_min": edges[:-1],
+                "dec_max": edges[1:],
+                "n_primary": n_primary,
+                "n_chance": n_chance,
+                "prior": 1 / (1 + n_chance),
+            }
+        )
+        for q in self.bayes_factor_quantiles:
+            prior_table[f"bayes_factor_q{q}"] = [
+                (
+                    np.quantile(bayes_factors[pair_bands == i], q)
+                    if (pair_bands == i).any()
+                    else np.nan
+                )
+                for i in range(self.n_dec_bands)
+            ]
+        logger.debug(f"scramble prior table\n{prior_table.to_string()}")
+        return prior_table
+
+    @cached_property
+    def prior_table(self) -> pd.DataFrame:
+        data = [load_catalog(self.primary_data, self.bayes_factor.primary_columns)]
+        data += [
+            load_catalog(d, self.bayes_factor.match_columns) for d in self.match_data
+        ]
+        config = self.model_dump(
+            exclude={
+                "workers": True,
+                "statistic": True,
+                "target_precision": True,
+                "batch_size": True,
+                "max_scrambles": True,
+                "bayes_factor": {"workers", "plot", "plot_indices", "contour_cache"},
+            },
+            mode="json",
+        )
+        key = "ampelmatch.match.prior.RAScramblePrior.prior_table-" + (
+            compute_density_hash((), {"data": data, "config": config})
+        )
+        store = TieredCache.default()
+        try:
+            return store.get(key)
+        except KeyError:
+            prior_table = self.compute_prior_table()
+            store.set(key, prior_table)
+            return prior_table
+
+    def evaluate_many(self, ra: np.ndarray, dec: np.ndarray) -> np.ndarray:
+        """Prior at the positions ``ra``, ``dec`` (in degrees), only dec matters"""
+        return self.prior_table["prior"].to_numpy()[self.dec_band(np.asarray(dec))]
 
 
-Prior = Union[SurfaceDensityPrior, RAScramblePrior]
+Prior = Union[SurfaceDensityPrior, MultiOrderDensityPrior, RAScramblePrior]
@@ -0,0 +1,154 @@
+import logging
+from functools import cached_property
+
+import healpy as hp
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+logger = logging.getLogger(__name__)
+
+
+class HealpixIndex:
+    """
+    Spatial index of a catalog, sorted by NESTED HEALPix pixel id.
+
+    Rows belonging to a set of pixels are found with range lookups on the sorted
+    pixel ids, so the index only has to be built once per catalog.
+    """
+
+    def __init__(self, data: pd.DataFrame, nside: int):
+        self.nside = nside
+        self.n_rows = len(data)
+        pixels = hp.ang2pix(
+            nside, data["ra"].to_numpy(), data["dec"].to_numpy(), nest=True, lonlat=True
+        )
+        self.order = np.argsort(pixels, kind="stable")
+        self.sorted_pixels = pixels[self.order]
+        logger.debug(f"built healpix index for {self.n_rows} rows at nside {nside}")
+
+    def query_ranges(
+        self, pixels: np.ndarray, nside: int | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Ranges in ``order`` of the catalog entries in ``pixels``. Pixels of a
+        coarser ``nside`` cover a contiguous range of the NESTED pixels of the
+        index.
+        """
+        pixels = np.asarray(pixels, dtype=np.int64)
+        shift = 0 if nside is None else 2 * ((self.nside // nside).bit_length() - 1)
+        start = np.searchsorted(self.sorted_pixels, pixels << shift, side="left")
+        stop = np.searchsorted(self.sorted_pixels, (pixels + 1) << shift, side="left")
+        return start, stop
+
+    def query(self, pixels: np.ndarray, nside: int | None = None) -> np.ndarray:
+        """Positional row numbers of all catalog entries in ``pixels``"""
+        start, stop = self.query_ranges(np.unique(pixels), nside)
+        counts = stop - start
+        if counts.sum() == 0:
+            return np.array([], dtype=int)
+        positions = np.repeat(start - np.cumsum(counts) + counts, counts) + np.arange(
+            counts.sum()
+        )
+        return self.order[positions]
+
+
+class KDTreeIndex:
+    """
+    Spatial index of a catalog as a KD-tree on 3D unit vectors.
+
+    Angular radii are converted to chord lengths, so radius queries are exact
+    and do not depend on a pixel resolution.
+    """
+
+    def __init__(self, data: pd.DataFrame):
+        self.n_rows = len(data)
+        self.tree = cKDTree(
+            self.unit_vectors(data["ra"].to_numpy(), data["dec"].to_numpy())
+        )
+        logger.debug(f"built kd-tree index for {self.n_rows} rows")
+
+    @staticmethod
+    def unit_vectors(ra: np.ndarray, dec: np.ndarray) -> np.ndarray:
+        return np.atleast_2d(hp.ang2vec(ra, dec, lonlat=True))
+
+    @staticmethod
+    def chord_length(radius_arcsec: float) -> float:
+        return 2 * np.sin(np.radians(radius_arcsec / 3600) / 2)
+
+    def query_pairs(
+        self, ra: np.ndarray, dec: np.ndarray, radius_arcsec: float
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Positional indices of all (position, catalog row) pairs closer than
+        ``radius_arcsec``
+        """
+        primary_tree = cKDTree(self.unit_vectors(ra, dec))
+        pairs = primary_tree.sparse_distance_matrix(
+            self.tree, self.chord_length(radius_arcsec), output_type="ndarray"
+        )
+        order = np.lexsort((pairs["j"], pairs["i"]))
+        return pairs["i"][order].astype(int), pairs["j"][order].astype(int)
+
+
+class ContourIndex:
+    """
+    Inverted pixel -> contour index in CSR layout.
+
+    ``pixels`` holds the sorted unique pixels covered by any contour, the contours
+    containing ``pixels[i]`` are ``contours[offsets[i]:offsets[i + 1]]``. Contours
+    are given as positional indices into the list they were built from.
+    """
+
+    def __init__(self, contour_pixels: list[np.ndarray]):
+        counts = [len(p) for p in contour_pixels]
+        all_pixels = np.concatenate(
+            [np.asarray(p, dtype=np.int64) for p in contour_pixels]
+            + [np.array([], dtype=np.int64)]
+        )
+        all_contours = np.repeat(np.arange(len(contour_pixels)), counts)
+        order = np.argsort(all_pixels, kind="stable")
+        self.pixels, pixel_counts = np.unique(all_pixels[order], return_counts=True)
+        self.offsets = np.append(0, np.cumsum(pixel_counts))
+        self.contours = all_contours[order]
+        self.n_contours = len(contour_pixels)
+        logger.debug(
+            f"built contour index for {self.n_contours} contours "
+            f"covering {len(self.pixels)} pixels"
+        )
+
+    def query(self, pixels: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        All (position in ``pixels``, contour) pairs where the contour contains
+        the pixel
+        """
+        pixels = np.atleast_1d(pixels)
+        pos = np.searchsorted(self.pixels, pixels)
+        found = pos < len(self.pixels)
+        found[found] = self.pixels[pos[found]] == pixels[found]
+        start = np.where(found, self.offsets[np.minimum(pos, len(self.pixels))], 0)
+        stop = np.where(found, self.offsets[np.minimum(pos + 1, len(self.pixels))], 0)
+        counts = stop - start
+        query = np.repeat(np.arange(len(pixels)), counts)
+        positions = np.repeat(start - np.cumsum(counts) + counts, counts) + np.arange(
+            counts.sum()
+        )
+        return query, self.contours[positions]
+
+    @cached_property
+    def pair_keys(self) -> np.ndarray:
+        """Sorted ``contour * stride + pixel`` keys of all (contour, pixel) pairs"""
+        pixels = np.repeat(self.pixels, np.diff(self.offsets))
+        return np.sort(self.contours * self.stride + pixels)
+
+    @property
+    def stride(self) -> int:
+        return int(self.pixels[-1]) + 1 if len(self.pixels) > 0 else 1
+
+    def contains(self, contours: np.ndarray, pixels: np.ndarray) -> np.ndarray:
+        """Whether ``contours[i]`` contains ``pixels[i]``"""
+        if len(self.pair_keys) == 0:
+            return np.zeros(len(pixels), dtype=bool)
+        keys = contours * self.stride + pixels
+        pos = np.minimum(np.searchsorted(self.pair_keys, keys), len(self.pair_keys) - 1)
+        return (self.pair_keys[pos] == keys) & (pixels < self.stride)
@@ -0,0 +1,159 @@
+import logging
+import tempfile
+from pathlib import Path
+
+import healpy as hp
+import numpy as np
+import pandas as pd
+
+from ampelmatch.match.bayes_factor import (
+    GaussianBayesFactor,
+    IceCubeContourBayesFactor,
+)
+from ampelmatch.match.pair_table import PairTable
+
+logger = logging.getLogger("ampelmatch.match.test_bayes_factor")
+
+
+def make_catalog(rng, n, sigma_arcsec, center=(150, 2), width=0.2):
+    return pd.DataFrame(
+        {
+            "ra": center[0] + rng.uniform(-width, width, n),
+            "dec": center[1] + rng.uniform(-width, width, n),
+            "sigma_arcsec": sigma_arcsec * rng.uniform(0.5, 1.5, n),
+        }
+    )
+
+
+def make_alerts(rng, n, directory: Path) -> pd.DataFrame:
+    """Skymaps with a circular contour of 2 to 8 degrees radius"""
+    alerts = []
+    for i in range(n):
+        nside = [32, 64][i % 2]
+        ra, dec = rng.uniform(0, 360), rng.uniform(-60, 60)
+        pixel_ra, pixel_dec = hp.pix2ang(nside, np.arange(12 * nside**2), lonlat=True)
+        distance = hp.rotator.angdist([ra, dec], [pixel_ra, pixel_dec], lonlat=True)
+        llh = (np.degrees(distance) / rng.uniform(2, 8)) ** 2 * 4.6
+        filename = directory / f"alert{i}.fits.gz"
+        hp.write_map(filename, llh, extra_header=[("COMMENTS", "Wilks theorem")])
+        alerts.append({"ra": ra, "dec": dec, "nside": nside, "filename": str(filename)})
+    return pd.DataFrame(alerts)
+
+
+def sorted_pairs(table: PairTable) -> pd.DataFrame:
+    return (
+        table.to_frame()
+        .sort_values(["primary_id", "catalog", "secondary_id"])
+        .reset_index(drop=True)
+    )
+
+
+def assert_same_pairs(a: PairTable, b: PairTable):
+    a, b = sorted_pairs(a), sorted_pairs(b)
+    assert len(a) == len(b), f"{len(a)} != {len(b)} pairs"
+    pd.testing.assert_frame_equal(a, b, check_exact=False, rtol=1e-12)
+
+
+if __name__ == "__main__":
+    logging.getLogger("ampelmatch").setLevel("INFO")
+    rng = np.random.default_rng(1)
+    primary_data = make_catalog(rng, 300, 0.1)
+    primary_data.index = np.repeat(np.arange(150), 2)
+    match_data = [make_catalog(rng, 3000, 1.0), make_catalog(rng, 500, 2.5)]
+
+    # batch evaluation gives the same pairs as the per-source loop
+    for nside in [1024, 128]:
+        for disc_radius_arcsec in [100, 5, None]:
+            config = {
+                "name": "test_bayes_factor",
+                "match_type": "gaussian",
+                "nside": nside,
+                "disc_radius_arcsec": disc_radius_arcsec,
+            }
+            per_source = GaussianBayesFactor(batch=False, **config).evaluate(
+                primary_data, match_data
+            )
+            batch = GaussianBayesFactor(**config).evaluate(primary_data, match_data)
+            assert_same_pairs(per_source, batch)
+            logger.info(
+                f"nside {nside}, disc {disc_radius_arcsec}: "
+                f"{len(batch)} pairs in batch and per-source mode"
+            )
+
+    # secondary catalogs may repeat index labels, pairs refer to rows
+    duplicated = [md.set_axis(np.arange(len(md)) // 2) for md in match_data]
+    config = {
+        "name": "test_bayes_factor",
+        "match_type": "gaussian",
+        "nside": 1024,
+        "disc_radius_arcsec": 5,
+    }
+    tables = [
+        GaussianBayesFactor(batch=batch, **config).evaluate(primary_data, duplicated)
+        for batch in [False, True]
+    ]
+    pairs = []
+    for table in tables:
+        order = np.lexsort((table.secondary, table.catalog, table.primary))
+        pairs.append(
+            [
+                getattr(table, c)[order]
+                for c in ["primary", "catalog", "secondary", "bayes_factor"]
+            ]
+        )
+    for a, b in zip(*pairs):
+        np.testing.assert_allclose(a, b, rtol=1e-12)
+    assert len(tables[0]) > 0
+    logger.info(f"{len(tables[0])} pairs with duplicated secondary labels")
+
+    # without a disc the candidate pairs are evaluated in steps
+    config = {
+        "name": "test_bayes_factor",
+        "match_type": "gaussian",
+        "nside": 1024,
+        "disc_radius_arcsec": None,
+    }
+    full = GaussianBayesFactor(**config).evaluate(primary_data, match_data)
+    GaussianBayesFactor.max_batch_pairs = 10_000
+    stepped = GaussianBayesFactor(**config).evaluate(primary_data, match_data)
+    del GaussianBayesFactor.max_batch_pairs
+    assert_same_pairs(full, stepped)
+    logger.info(f"{len(stepped)} pairs in steps of at most 10000")
+
+    # the kd-tree engine finds the same pairs as the HEALPix index
+    for disc_radius_arcsec in [100, 5]:
+        config = {
+            "name": "test_bayes_factor",
+            "match_type": "gaussian",
+            "nside": 1024,
+            "disc_radius_arcsec": disc_radius_arcsec,
+        }
+        healpix = GaussianBayesFactor(**config).evaluate(primary_data, match_data)
+        kdtree = GaussianBayesFactor(candidate_engine="kdtree", **config).evaluate(
+            primary_data, match_data
+        )
+        assert_same_pairs(healpix, kdtree)
+        logger.info(f"disc {disc_radius_arcsec}: {len(kdtree)} pairs with kdtree")
+
+    # contour Bayes factors of all primaries in one pass
+    sky_data = pd.DataFrame(
+        {
+            "ra": rng.uniform(0, 360, 3000),
+            "dec": np.degrees(np.arcsin(rng.uniform(-1, 1, 3000))),
+        }
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        alerts = make_alerts(rng, 12, Path(directory))
+        config = {
+            "name": "test_bayes_factor",
+            "match_type": "icecube_contour",
+            "nside": 64,
+        }
+        per_source = IceCubeContourBayesFactor(batch=False, **config).evaluate(
+            sky_data, [alerts]
+        )
+        batch = IceCubeContourBayesFactor(**config).evaluate(sky_data, [alerts])
+    assert_same_pairs(per_source, batch)
+    n_inside = (batch.bayes_factor > 1).sum()
+    assert n_inside > 0
+    logger.info(f"{len(batch)} contour pairs, {n_inside} inside the contour")
@@ -0,0 +1,90 @@
+import logging
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from ampelmatch.match.catalog import iter_catalog, read_catalog, write_catalog
+from ampelmatch.match.pair_table import PairTable
+from ampelmatch.match.test_bayes_factor import make_catalog
+
+logger = logging.getLogger("ampelmatch.match.test_catalog")
+
+
+if __name__ == "__main__":
+    logging.getLogger("ampelmatch").setLevel("INFO")
+    rng = np.random.default_rng(3)
+    data = make_catalog(rng, 10_000, 1.0)
+    data["source_index"] = np.repeat(np.arange(5000), 2)
+    data["band"] = rng.choice(["ztfg", "ztfr"], len(data))
+    columns = ["ra", "dec", "sigma_arcsec"]
+
+    with tempfile.TemporaryDirectory() as directory:
+        csv_file = Path(directory) / "catalog.csv"
+        parquet_file = Path(directory) / "catalog.parquet"
+        write_catalog(data, csv_file)
+        write_catalog(data.iloc[:4000], parquet_file)
+        write_catalog(data.iloc[4000:], parquet_file, append=True)
+
+        # parquet and CSV give the same frame, with only the requested columns
+        specs = [
+            {"filepath_or_buffer": csv_file, "index_col": "source_index"},
+            {"filepath_or_buffer": parquet_file, "index_col": "source_index"},
+        ]
+        from_csv, from_parquet = [read_catalog(spec, columns) for spec in specs]
+        pd.testing.assert_frame_equal(from_csv, from_parquet)
+        assert list(from_parquet.columns) == columns
+
+        # the header is found with the reader options of the spec
+        other_csv_file = Path(directory) / "other.csv"
+        other_csv_file.write_text(
+            "# written by another survey\n"
+            + data.iloc[:100][["source_index", *columns, "band"]].to_csv(
+                sep=";", index=False
+            )
+        )
+        other = read_catalog(
+            {
+                "filepath_or_buffer": other_csv_file,
+                "index_col": 0,
+                "sep": ";",
+                "skiprows": 1,
+            },
+            columns,
+        )
+        pd.testing.assert_frame_equal(other, from_csv.iloc[:100])
+
+        # region filters on parquet select exactly the rows in the region
+        region = {"ra": [149.9, 150.0], "dec": [2.0, 2.1]}
+        selected = read_catalog(specs[1] | {"region": region}, columns)
+        m = data["ra"].between(*region["ra"]) & data["dec"].between(*region["dec"])
+        pd.testing.assert_frame_equal(selected, from_csv[m.to_numpy()])
+
+        # chunks add up to the whole catalog
+        for spec in specs:
+            chunks = list(iter_catalog(spec, 3000, columns))
+            pd.testing.assert_frame_equal(pd.concat(chunks), from_csv)
+        logger.info(f"read {len(from_parquet)} rows, {m.sum()} in region")
+
+        # pair tables round-trip through both formats
+        table = PairTable.from_arrays(
+            pd.Index(np.arange(10)),
+            [pd.Index(np.arange(100, 200))],
+            [(rng.integers(0, 10, 50), rng.integers(0, 100, 50), rng.random(50))],
+        )
+        for suffix in [".csv", ".parquet"]:
+            filename = Path(directory) / f"pairs{suffix}"
+            table.write(filename)
+            pd.testing.assert_frame_equal(
+                (
+                    pd.read_csv(filename)
+                    if suffix == ".csv"
+                    else pd.read_parquet(filename)
+                ),
+                table.to_frame(),
+                check_dtype=False,
+            )
+        empty = PairTable.from_arrays(pd.Index(np.arange(10)), [], [])
+        assert list(empty.to_frame().columns) == list(table.to_frame().columns)
+        logger.info(f"wrote {len(table)} pairs")
@@ -3,7 +3,6 @@ from pathlib import Path
 
 import matplotlib.pyplot as plt
 import numpy as np
-import pandas as pd
 from ampelmatch.data.config import DatasetConfig
 from ampelmatch.data.dataset import DatasetGenerator
 from ampelmatch.data.plotter import Plotter
@@ -81,8 +80,8 @@ if __name__ == "__main__":
         }
         matcher = match.StreamMatch.model_validate(match_config)
         probabilities = matcher.posteriors
-        primary_data = pd.read_csv(**matcher.primary_data)
-        match_data = [pd.read_csv(**d) for d in matcher.match_data]
+        primary_data = matcher.read_primary_data()
+        match_data = matcher.read_match_data()
         matches = matcher.match()
         eff = []
         pur = []
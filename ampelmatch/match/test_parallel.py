@@ -0,0 +1,66 @@
+import logging
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from ampelmatch.match.bayes_factor import (
+    GaussianBayesFactor,
+    IceCubeContourBayesFactor,
+)
+from ampelmatch.match.test_bayes_factor import (
+    assert_same_pairs,
+    make_alerts,
+    make_catalog,
+)
+
+logger = logging.getLogger("ampelmatch.match.test_parallel")
+
+
+if __name__ == "__main__":
+    logging.getLogger("ampelmatch").setLevel("INFO")
+    rng = np.random.default_rng(2)
+
+    # sharded evaluation gives the same pairs as the serial one, also for
+    # primaries close to the shard borders
+    primary_data = make_catalog(rng, 4000, 0.1, center=(180, 0), width=5)
+    primary_data.index = np.repeat(np.arange(2000), 2)
+    match_data = [
+        make_catalog(rng, 100_000, 1.0, center=(180, 0), width=5),
+        make_catalog(rng, 20_000, 2.5, center=(180, 0), width=5),
+    ]
+    for candidate_engine in ["healpix", "kdtree"]:
+        config = {
+            "name": "test_parallel",
+            "match_type": "gaussian",
+            "nside": 1024,
+            "candidate_engine": candidate_engine,
+        }
+        serial = GaussianBayesFactor(**config).evaluate(primary_data, match_data)
+        sharded = GaussianBayesFactor(workers=4, **config).evaluate(
+            primary_data, match_data
+        )
+        assert_same_pairs(serial, sharded)
+        logger.info(f"{candidate_engine}: {len(sharded)} pairs on 4 workers")
+
+    # object columns like the contour filenames reach the workers
+    sky_data = pd.DataFrame(
+        {
+            "ra": rng.uniform(0, 360, 3000),
+            "dec": np.degrees(np.arcsin(rng.uniform(-1, 1, 3000))),
+        }
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        alerts = make_alerts(rng, 12, Path(directory))
+        config = {
+            "name": "test_parallel",
+            "match_type": "icecube_contour",
+            "nside": 64,
+        }
+        serial = IceCubeContourBayesFactor(**config).evaluate(sky_data, [alerts])
+        sharded = IceCubeContourBayesFactor(workers=4, **config).evaluate(
+            sky_data, [alerts]
+        )
+    assert_same_pairs(serial, sharded)
+    logger.info(f"contours: {len(sharded)} pairs on 4 workers")
@@ -0,0 +1,168 @@
+import logging
+import tempfile
+from pathlib import Path
+
+import healpy as hp
+import numpy as np
+import pandas as pd
+
+from ampelmatch.match.prior import (
+    MultiOrderDensityPrior,
+    RAScramblePrior,
+    SurfaceDensityPrior,
+)
+from ampelmatch.match.test_bayes_factor import assert_same_pairs, make_catalog
+
+logger = logging.getLogger("ampelmatch.match.test_prior")
+
+
+if __name__ == "__main__":
+    logging.getLogger("ampelmatch").setLevel("INFO")
+    rng = np.random.default_rng(5)
+
+    # a dense core on top of sources all over the sky
+    def make_sky(n, sigma_arcsec):
+        return pd.DataFrame(
+            {
+                "ra": rng.uniform(0, 360, n),
+                "dec": np.degrees(np.arcsin(rng.uniform(-1, 1, n))),
+                "sigma_arcsec": sigma_arcsec,
+            }
+        )
+
+    primary_data = pd.concat([make_catalog(rng, 2000, 0.1), make_sky(5000, 0.1)])
+    primary_data.index = pd.Index(np.arange(len(primary_data)), name="source_index")
+    match_data = [
+        pd.concat([make_catalog(rng, n, 1.0), make_sky(m, 1.0)])
+        for n, m in [(5000, 20000), (2000, 10000)]
+    ]
+
+    with tempfile.TemporaryDirectory() as directory:
+        primary_spec = {
+            "filepath_or_buffer": Path(directory) / "primary.csv",
+            "index_col": "source_index",
+        }
+        primary_data.to_csv(primary_spec["filepath_or_buffer"])
+        match_specs = []
+        for i, md in enumerate(match_data):
+            match_specs.append({"filepath_or_buffer": Path(directory) / f"{i}.csv"})
+            md.to_csv(match_specs[-1]["filepath_or_buffer"], index=False)
+
+        # leaves do not overlap and every primary source falls into one
+        prior = MultiOrderDensityPrior(
+            name="multi_order_density",
+            primary_data=primary_spec,
+            match_data=match_specs,
+            max_order=12,
+        )
+        start, end, _ = prior.leaf_ranges
+        assert (np.diff(start) > 0).all() and (start[1:] >= end[:-1]).all()
+        priors = prior.evaluate_sources(primary_data)
+        assert np.isfinite(priors).all()
+        logger.info(f"{len(start)} leaves, median prior {np.median(priors)}")
+
+        # a deep field inside a shallow all-sky catalog is resolved, the prior
+        # inside of it follows the density of the deep catalog
+        deep_primary = pd.concat(
+            [make_sky(100_000, 0.1), make_catalog(rng, 2000, 0.1, width=0.5)]
+        )
+        deep_primary.index = pd.Index(np.arange(len(deep_primary)), name="source_index")
+        deep_match = make_catalog(rng, 20_000, 1.0, width=0.5)
+        deep_specs = [
+            {
+                "filepath_or_buffer": Path(directory) / "deep_primary.csv",
+                "index_col": "source_index",
+            },
+            {"filepath_or_buffer": Path(directory) / "deep_match.csv"},
+        ]
+        deep_primary.to_csv(deep_specs[0]["filepath_or_buffer"])
+        deep_match.to_csv(deep_specs[1]["filepath_or_buffer"], index=False)
+        deep = MultiOrderDensityPrior(
+            name="multi_order_density",
+            primary_data=deep_specs[0],
+            match_data=deep_specs[1:],
+            max_order=10,
+        )
+        inside = deep_primary.iloc[-2000:]
+        inside = inside[
+            (inside.ra - 150).abs().lt(0.4) & (inside.dec - 2).abs().lt(0.4)
+        ]
+        start, end, _ = deep.leaf_ranges
+        leaf = np.searchsorted(
+            start,
+            hp.ang2pix(2**10, inside.ra, inside.dec, nest=True, lonlat=True),
+            side="right",
+        )
+        leaf_order = 10 - np.log2(end - start)[leaf - 1] / 2
+        area = np.radians(1) ** 2 * np.cos(np.radians(2))
+        expected = 1 / (4 * np.pi * len(deep_match) / area)
+        priors = deep.evaluate_sources(inside)
+        assert (leaf_order >= 8).all(), np.unique(leaf_order)
+        np.testing.assert_allclose(np.median(priors), expected, rtol=0.1)
+        logger.info(
+            f"deep field at order {np.median(leaf_order):.0f}, median prior "
+            f"{np.median(priors):.3g}, expected {expected:.3g}"
+        )
+
+        # per-source and batch evaluation agree for both density priors
+        surface = SurfaceDensityPrior(
+            name="surface_density",
+            primary_data=primary_spec,
+            match_data=match_specs,
+            nside=64,
+            area_sqdg=1,
+        )
+        for p in [prior, surface]:
+            sample = primary_data.iloc[:50]
+            single = [p(sample.loc[[i]]) for i in sample.index]
+            np.testing.assert_allclose(p.evaluate_sources(sample), single)
+        logger.info("per-source and batch priors agree")
+
+        # the catalogs are counted chunk by chunk, the chunk size does not matter
+        chunked = surface.model_copy(update={"chunk_size": 97})
+        counts = surface.pixel_counts(64)
+        for c, cc in zip(counts, chunked.pixel_counts(64)):
+            pd.testing.assert_series_equal(c, cc)
+        assert counts[0].sum() == primary_data.index.nunique()
+        logger.info(f"{[len(c) for c in counts]} occupied pixels per catalog")
+
+        # scrambles only depend on the seed, not on the number of workers
+        core = primary_data.iloc[:2000]
+        core.to_csv(primary_spec["filepath_or_buffer"])
+        config = {
+            "name": "ra_scramble",
+            "primary_data": primary_spec,
+            "match_data": match_specs,
+            "bayes_factor": {
+                "name": f"{directory}/bayes_factor",
+                "match_type": "gaussian",
+                "nside": 1024,
+                "disc_radius_arcsec": 10,
+            },
+            "n_scrambles": 6,
+            "seed": 42,
+            "batch_size": 4,
+            "max_scrambles": 12,
+        }
+        serial, sharded = [
+            RAScramblePrior.model_validate(config | {"workers": workers})
+            for workers in [1, 3]
+        ]
+        tables = serial.scrambled_bayes_factors()
+        for a, b in zip(tables, sharded.scrambled_bayes_factors()):
+            assert_same_pairs(a, b)
+        assert len({len(t) for t in tables}) > 1
+        pd.testing.assert_frame_equal(
+            serial.tail_probabilities(), sharded.tail_probabilities()
+        )
+        logger.info(f"{len(tables)} scrambles agree with 1 and 3 workers")
+
+        # dec bands without primary sources get the mean chance rate of all
+        # bands, not a prior of one
+        table = serial.prior_table
+        empty = table["n_primary"] == 0
+        overall = (table["n_chance"] * table["n_primary"]).sum() / len(core)
+        assert empty.any() and (table["n_chance"] > 0).all()
+        np.testing.assert_allclose(table.loc[empty, "n_chance"], overall)
+        assert (serial.evaluate_many(np.zeros(1), np.array([-80.0])) < 1).all()
+        logger.info(f"prior table with {empty.sum()} empty dec bands")
@@ -0,0 +1,94 @@
+import json
+import logging
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from ampelmatch.match.catalog import CatalogRegistry
+from ampelmatch.match.match import StreamMatch
+from ampelmatch.match.test_bayes_factor import make_catalog
+
+logger = logging.getLogger("ampelmatch.match.test_stream")
+
+
+def sorted_frame(data: pd.DataFrame) -> pd.DataFrame:
+    return data.sort_values(["primary_id", "catalog", "secondary_id"]).reset_index(
+        drop=True
+    )
+
+
+if __name__ == "__main__":
+    logging.getLogger("ampelmatch").setLevel("INFO")
+    rng = np.random.default_rng(4)
+    sources = make_catalog(rng, 400, 0.1)
+    primary_data = sources.iloc[np.repeat(np.arange(400), 3)]
+    primary_data.index = pd.Index(np.repeat(np.arange(400), 3), name="source_index")
+    # half of the sources have a counterpart in each secondary catalog
+    match_data = []
+    for sigma_arcsec, n_background in [(1.0, 3000), (2.5, 800)]:
+        counterparts = sources.sample(200, random_state=rng.integers(1000))
+        counterparts = counterparts.assign(sigma_arcsec=sigma_arcsec)
+        counterparts[["ra", "dec"]] += rng.normal(0, sigma_arcsec / 3600, (200, 2))
+        match_data.append(
+            pd.concat([counterparts, make_catalog(rng, n_background, sigma_arcsec)])
+        )
+
+    with tempfile.TemporaryDirectory() as directory:
+        primary_spec = {
+            "filepath_or_buffer": Path(directory) / "primary.csv",
+            "index_col": "source_index",
+        }
+        primary_data.to_csv(primary_spec["filepath_or_buffer"])
+        match_specs = []
+        for i, md in enumerate(match_data):
+            match_specs.append({"filepath_or_buffer": Path(directory) / f"{i}.csv"})
+            md.to_csv(match_specs[-1]["filepath_or_buffer"], index=False)
+
+        matcher = StreamMatch.model_validate(
+            {
+                "primary_data": primary_spec,
+                "match_data": match_specs,
+                "bayes_factor": {
+                    "name": f"{directory}/bayes_factor",
+                    "match_type": "gaussian",
+                    "nside": 1024,
+                },
+                "prior": {
+                    "name": "surface_density",
+                    "nside": 64,
+                    "area_sqdg": 0.16,
+                    "primary_data": primary_spec,
+                    "match_data": match_specs,
+                },
+                "posterior_threshold": 0.95,
+            }
+        )
+
+        # streaming never loads the whole primary catalog, not even for the prior
+        output = Path(directory) / "posteriors.parquet"
+        chunks = list(matcher.iter_posteriors(chunk_size=97, output=output))
+        loaded = [json.loads(k) for k in CatalogRegistry.default().catalogs]
+        assert str(primary_spec["filepath_or_buffer"]) not in [
+            k["filepath_or_buffer"] for k in loaded
+        ]
+
+        # streaming in chunks gives the same posteriors as the full match
+        full = sorted_frame(matcher.posteriors.to_frame())
+        streamed = sorted_frame(pd.concat([c.to_frame() for c in chunks]))
+        written = sorted_frame(pd.read_parquet(output))
+        pd.testing.assert_frame_equal(full, streamed)
+        pd.testing.assert_frame_equal(full, written, check_dtype=False)
+        assert sum(len(c.primary_ids) for c in chunks) == len(sources)
+        assert full["posterior"].max() > 0
+        logger.info(f"{len(chunks)} chunks with {len(full)} pairs")
+
+        # shuffled rows of sources are rejected instead of being split
+        shuffled = primary_data.sample(frac=1, random_state=1)
+        shuffled.to_csv(primary_spec["filepath_or_buffer"])
+        try:
+            list(matcher.read_primary_chunks(97))
+            raise AssertionError("shuffled sources should be rejected")
+        except ValueError as e:
+            logger.info(f"rejected: {e}")
@@ -0,0 +1,72 @@
+import logging
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from ampelmatch.cache import TieredCache
+
+logger = logging.getLogger("ampelmatch.test_cache")
+
+
+def assert_same(a, b):
+    if isinstance(a, pd.DataFrame):
+        pd.testing.assert_frame_equal(a, b)
+    elif isinstance(a, pd.Series):
+        pd.testing.assert_series_equal(a, b)
+    elif isinstance(a, np.ndarray):
+        np.testing.assert_array_equal(a, b)
+        assert a.dtype == b.dtype
+    else:
+        assert a == b
+
+
+if __name__ == "__main__":
+    logging.getLogger("ampelmatch").setLevel("INFO")
+    rng = np.random.default_rng(6)
+    values = {
+        "frame": pd.DataFrame({"ra": rng.random(10), "n": np.arange(10)}),
+        "named_frame": pd.DataFrame(
+            {"ra": rng.random(10)}, index=pd.Index(np.arange(10), name="source_index")
+        ),
+        "multi_index": pd.DataFrame(
+            {"flux": rng.random(6)},
+            index=pd.MultiIndex.from_product([[1, 2], [0, 1, 2]]),
+        ),
+        "series": pd.Series(rng.random(10)),
+        "named_series": pd.Series(
+            rng.random(10), index=pd.Index(np.arange(10) * 4 + 4, name="uniq")
+        ),
+        "values_series": pd.Series(rng.random(3), name="values"),
+        "array": rng.random((3, 4)),
+        "objects": {"a": [1, 2]},
+    }
+
+    # disk and memory hits give back what was stored
+    with tempfile.TemporaryDirectory() as directory:
+        cache = TieredCache(directory)
+        for key, value in values.items():
+            cache.set(key, value)
+        cold = TieredCache(directory)
+        for key, value in values.items():
+            assert_same(value, cache.get(key))
+            assert_same(value, cold.get(key))
+            assert_same(value, cold.get(key))
+        logger.info(f"{len(values)} entries round-trip through memory and disk")
+
+        # copies handed out do not change the cache
+        frame = cache.get("frame")
+        frame.iloc[0, 0] = -1
+        assert_same(values["frame"], cache.get("frame"))
+
+        # the memory tier is bounded in bytes, entries stay on disk
+        small = TieredCache(directory, max_memory_bytes=500)
+        for key in ["frame", "named_frame", "series"]:
+            small.get(key)
+        assert sum(small.memory_sizes.values()) <= 500
+        assert "frame" not in small.memory and "frame" in small
+        big = pd.DataFrame({"x": np.arange(1000)})
+        small.set("big", big)
+        assert "big" not in small.memory
+        assert_same(big, small.get("big"))
+        logger.info(f"{len(small.memory)} entries in a memory tier of 500 bytes")